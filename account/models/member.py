@@ -31,6 +31,10 @@ except Exception:
 # we need bigger usernames, in particular for RemoteMember
 AbstractUser._meta.get_field('username').max_length = 128
 AUTH_CODE_EXPIRES_SECS = getattr(settings, "AUTH_CODE_EXPIRES_SECS", 1440)
+# members active in the last ACTIVITY_ONLINE_SECS count as online
+ACTIVITY_ONLINE_SECS = getattr(settings, "ACTIVITY_ONLINE_SECS", 300)
+# seconds between buffered activity writes for the same member
+ACTIVITY_RESOLUTION_SECS = getattr(settings, "ACTIVITY_RESOLUTION_SECS", 60)
 
 
 class User(AbstractUser, RestModel):
@@ -178,7 +182,13 @@ class Member(User, RestModel, MetaDataModel):
 
     @property
     def is_online(self):
-        return self.getActiveConnections()
+        count = self.getActiveConnections()
+        if count:
+            return count
+        last_seen = rest_helpers.getBufferedTimestamp("members:activity", self.pk)
+        if last_seen and (datetime.now() - last_seen).total_seconds() < ACTIVITY_ONLINE_SECS:
+            return 1
+        return 0
 
     @property
     def is_blocked(self):
@@ -231,7 +241,7 @@ class Member(User, RestModel, MetaDataModel):
 
     def recordSuccessLogin(self, request):
         self.last_login = datetime.now()
-        self.save()
+        self.save(update_fields=["last_login"])
         RemoteEvents.hdel("users:failed:username", self.username)
         RemoteEvents.hdel("users:failed:ip", request.ip)
 
@@ -282,20 +292,46 @@ class Member(User, RestModel, MetaDataModel):
             return False
         return True
 
+    def getLastTouched(self, key, value):
+        # the db value lags behind the redis buffer until the next flush
+        try:
+            buffered = rest_helpers.getBufferedTimestamp(key, self.pk)
+        except Exception:
+            buffered = None
+        if buffered and (not value or buffered > value):
+            return buffered
+        return value
+
     def touchActivity(self, force=False, last_login=False):
-        is_dirty = False
-        update_last_activity = datetime.now() - timedelta(minutes=5)
-        if force or not self.last_activity or (self.last_activity and self.last_activity < update_last_activity):
-            self.last_activity = datetime.now()
-            is_dirty = True
+        # timestamps are buffered in redis and written by Member.FlushActivity
+        now = datetime.now()
+        touched = {}
+        update_last_activity = now - timedelta(seconds=ACTIVITY_RESOLUTION_SECS)
+        last_activity = None if force else self.getLastTouched("members:activity", self.last_activity)
+        if force or not last_activity or last_activity < update_last_activity:
+            self.last_activity = now
+            touched["last_activity"] = "members:activity"
         if last_login:
-            update_last_login = datetime.now() - timedelta(hours=1)
-            if not self.last_login or (self.last_login and self.last_login < update_last_login):
-                self.last_login = datetime.now()
-                self.last_activity = self.last_login
-                is_dirty = True
-        if is_dirty:
-            self.save()
+            update_last_login = now - timedelta(hours=1)
+            last_login = self.getLastTouched("members:last_login", self.last_login)
+            if not last_login or last_login < update_last_login:
+                self.last_login = now
+                self.last_activity = now
+                touched["last_activity"] = "members:activity"
+                touched["last_login"] = "members:last_login"
+        for field, key in touched.items():
+            try:
+                rest_helpers.bufferTimestamp(key, self.pk, now.timestamp())
+            except Exception:
+                rest_helpers.log_exception("touchActivity")
+                Member.objects.filter(pk=self.pk).update(**{field: now})
+
+    @classmethod
+    def FlushActivity(cls):
+        # writes buffered activity timestamps, keeping recent ones for is_online
+        count = rest_helpers.flushTimestamps("members:activity", cls, "last_activity", keep=ACTIVITY_ONLINE_SECS)
+        rest_helpers.flushTimestamps("members:last_login", User, "last_login")
+        return count
 
     def addPermission(self, perm):
         self.setProperty(perm, 1, "permissions")
@@ -316,7 +352,7 @@ class Member(User, RestModel, MetaDataModel):
                 if self.hasPerm(i):
                     return True
             return False
-        return self.getProperty(perm, 0, "permissions", bool)
+        return perm in self.getPermissionSet()
 
     def hasGroupPerm(self, group, perm):
         if group is None:
@@ -905,7 +941,8 @@ class Member(User, RestModel, MetaDataModel):
 
     @staticmethod
     def FilterOnline(is_online, qset):
-        ids = list(RemoteEvents.smembers("member:online"))
+        ids = [pk.decode() for pk in RemoteEvents.smembers("member:online")]
+        ids.extend(rest_helpers.getBufferedSince("members:activity", ACTIVITY_ONLINE_SECS))
         if is_online:
             qset = qset.filter(pk__in=ids)
         else:
@@ -938,16 +975,15 @@ class Member(User, RestModel, MetaDataModel):
         # this is deprecated, only using for backwards
         from importlib import import_module
         from rest import UberDict
-        # engine = import_module(settings.SESSION_ENGINE)
-        # SessionStore = engine.SessionStore
-        # session = SessionStore(auth_data.token)
-        session = Session.objects.filter(session_key=auth_data.token).last()
-        if session is None:
-            rest_helpers.log_print("no session for key", auth_data)
-            return None
-        session_data = session.get_decoded()
+        # use the configured engine so non db session backends work
+        engine = import_module(settings.SESSION_ENGINE)
+        # load() instead of exists(), signed_cookies keeps no server side record
+        session_data = engine.SessionStore(auth_data.token).load() if auth_data.token else {}
         rest_helpers.log_print(session_data)
         uid = session_data.get('_auth_user_id')
+        if not uid:
+            rest_helpers.log_print("no session for key", auth_data)
+            return None
         member = cls.objects.filter(pk=uid).last()
         if member is not None:
             return UberDict(kind="member", pk=uid, member=member)
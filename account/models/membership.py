@@ -130,7 +130,10 @@ class Membership(models.Model, RestModel, MetaDataModel):
         self.setProperty(perm, None, "permissions")
 
     def clearPermissions(self):
-        return self.properties.filter(category="permissions").delete()
+        res = self.properties.filter(category="permissions").delete()
+        self.clearPropertyCache()
+        self.clearPermissionCache()
+        return res
 
     def getPermissions(self):
         return list(self.properties.filter(category="permissions", int_value__gt=0).values_list("key", flat=True))
@@ -146,7 +149,7 @@ class Membership(models.Model, RestModel, MetaDataModel):
                 if self.hasPerm(i):
                     return True
             return False
-        return self.getProperty(perm, 0, "permissions", bool)
+        return perm in self.getPermissionSet()
 
     def hasRole(self, role):
         if not self.is_enabled:
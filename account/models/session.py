@@ -3,6 +3,7 @@ from datetime import datetime
 
 from rest.models import RestModel
 from rest import ua
+from rest import helpers
 
 
 # replacing legacy cookie session system with more robust session info
@@ -44,8 +45,17 @@ class AuthSession(models.Model, RestModel):
     device = models.CharField(max_length=64, null=True, blank=True, default=None)
 
     def touch(self):
+        # buffered in redis, written by AuthSession.FlushActivity
         self.last_activity = datetime.now()
-        self.save()
+        try:
+            helpers.bufferTimestamp("authsessions:activity", self.pk, self.last_activity.timestamp())
+        except Exception:
+            helpers.log_exception("AuthSession.touch")
+            AuthSession.objects.filter(pk=self.pk).update(last_activity=self.last_activity)
+
+    @classmethod
+    def FlushActivity(cls):
+        return helpers.flushTimestamps("authsessions:activity", cls, "last_activity")
 
     def updateLocation(self):
         if self.location is None and self.ip:
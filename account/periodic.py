@@ -1,6 +1,6 @@
-from rest.decorators import periodic
+from rest.decorators import periodic, PERIODIC_EVERY_5_MINUTES
 from datetime import datetime, timedelta
-from .models import Member
+from .models import Member, AuthSession
 from sessionlog.models import SessionLog
 
 
@@ -15,3 +15,10 @@ def run_cleanup_tokens(force=False, verbose=False, now=None):
     # lets prune old non active sessions
     SessionLog.Clean(limit=10000)
 
+
+
+@periodic(minute=PERIODIC_EVERY_5_MINUTES)
+def run_flush_activity(force=False, verbose=False, now=None):
+    # write the redis buffered activity timestamps in bulk
+    Member.FlushActivity()
+    AuthSession.FlushActivity()
@@ -332,6 +332,8 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         VIEW_PERMS = ["view_media"]
         SAVE_PERMS = ["manage_media"]
         OWNER_FIELD = "owner"
+        # graphs reading renditions (thumbnail_url, smart_renditions) through getRenditionIndex
+        PREFETCH_RELATED = {"simple": ["renditions"], "basic": ["renditions"]}
         GRAPHS = {
             "simple": {
                 "fields": [
@@ -436,7 +438,69 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         List uses available for this item
         """
-        return list(self.renditions.values('use').distinct().values_list('use', flat=True))
+        return list(self.getRenditionIndex()["use"].keys())
+
+    def getRenditionIndex(self):
+        """
+        returns {"all": [...], "use": {use: [...]}, "name": {name: [...]}} of the renditions loaded
+        with one query (or from prefetch_related("renditions")) and kept on the instance
+        """
+        index = getattr(self, "_rendition_index", None)
+        if index is None:
+            index = {"all": [], "use": {}, "name": {}}
+            for r in self.renditions.all():
+                index["all"].append(r)
+                index["use"].setdefault(r.use, []).append(r)
+                index["name"].setdefault(r.name, []).append(r)
+            self._rendition_index = index
+        return index
+
+    def clearRenditionCache(self):
+        self._rendition_index = None
+        prefetched = getattr(self, "_prefetched_objects_cache", None)
+        if prefetched:
+            prefetched.pop("renditions", None)
+
+    def findRendition(self, use=None, kind=None, name=None, is_original=None, exclude_kind=None,
+                      min_width=None, max_width=None, max_height=None, order=("-created",)):
+        """
+        first rendition matching the filters sorted like order_by(*order),
+        answered from getRenditionIndex() instead of a query
+        """
+        index = self.getRenditionIndex()
+        uses = (use,) if isinstance(use, str) else use
+        if name is not None:
+            renditions = index["name"].get(name, [])
+        elif uses is not None:
+            renditions = [r for u in uses for r in index["use"].get(u, [])]
+        else:
+            renditions = index["all"]
+        matches = []
+        for r in renditions:
+            if uses is not None and r.use not in uses:
+                continue
+            if kind is not None and r.kind != kind:
+                continue
+            if exclude_kind is not None and r.kind == exclude_kind:
+                continue
+            if is_original is not None and r.is_original != is_original:
+                continue
+            # NULL sizes never match a range, same as in sql
+            if min_width is not None and (r.width is None or r.width < min_width):
+                continue
+            if max_width is not None and (r.width is None or r.width > max_width):
+                continue
+            if max_height is not None and (r.height is None or r.height > max_height):
+                continue
+            matches.append(r)
+        for field in reversed(order):
+            desc = field.startswith("-")
+            field = field.lstrip("-")
+            # NULLs sort last ascending and first descending, like postgres
+            matches.sort(key=lambda r: (getattr(r, field) is None, getattr(r, field)), reverse=desc)
+        if matches:
+            return matches[0]
+        return None
 
     def rerender(self):
         self.deleteRenditions()
@@ -618,12 +682,9 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         Get original rendition
         """
-        try:
-            if self.kind == 'A':
-                return self.renditions.exclude(kind='L').filter(is_original=True).order_by('created')[0]
-            return self.renditions.filter(is_original=True).order_by('-created')[0]
-        except IndexError:
-            return None
+        if self.kind == 'A':
+            return self.findRendition(exclude_kind='L', is_original=True, order=('created',))
+        return self.findRendition(is_original=True)
 
     def still(self):
         """
@@ -631,10 +692,10 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         if self.kind == 'I':
             return self.original()
-        try:
-            return self.renditions.filter(use='still').order_by('-created')[0]
-        except IndexError:
+        still = self.findRendition(use='still')
+        if still is None:
             return MediaItemRendition(name="Preview not yet available", url="/static/img/noimage.gif", fake=True)
+        return still
 
     def poster_url(self, request=None):
         return self.get('poster', 'still', 'original', 'noimage').view_url(request=request, expires=None)
@@ -646,17 +707,16 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         for use in args:
             if use == 'noimage':
                 return MediaItemRendition(name="Rendition not yet available", url="/static/img/noimage.gif", fake=True)
-            try:
-                return self.renditions.filter(use=use).order_by('-created')[0]
-            except IndexError:
-                pass
+            rendition = self.findRendition(use=use)
+            if rendition is not None:
+                return rendition
         return None
 
     def thumbnail_animated(self):
         """
         Get animated thumbnail rendition
         """
-        return self.renditions.filter(use='thumbnail-animated').order_by('-created').first()
+        return self.findRendition(use='thumbnail-animated')
 
     def isImage(self):
         org = self.original()
@@ -685,18 +745,13 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         Get small tumbnail rendition
         """
-        try:
-            return self.renditions.filter(use='image', width__lt=200).order_by('-created')[0]
-        except IndexError:
-            pass
-        try:
-            return self.renditions.filter(use='image').order_by('-created')[0]
-        except IndexError:
-            pass
+        image = self.findRendition(use='image', max_width=199) or self.findRendition(use='image')
+        if image is not None:
+            return image
         return self.still()
 
     def thumbnail_url(self, width=320):
-        thumb = self.renditions.filter(kind="I", use="thumbnail", width__lte=width).order_by('-width').first()
+        thumb = self.findRendition(kind="I", use="thumbnail", max_width=width, order=('-width',))
         if thumb:
             return thumb.view_url_nonexpire()
         return None
@@ -705,14 +760,9 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         Get small tumbnail rendition
         """
-        try:
-            return self.renditions.filter(use='thumbnail', width__lt=80).order_by('-created')[0]
-        except IndexError:
-            pass
-        try:
-            return self.renditions.filter(use='thumbnail').order_by('-created')[0]
-        except IndexError:
-            pass
+        thumb = self.findRendition(use='thumbnail', max_width=79) or self.findRendition(use='thumbnail')
+        if thumb is not None:
+            return thumb
         if self.kind == '*':
             return MediaItemRendition(name="Unknown Attachment", url="/static/img/unknown.gif", fake=True)
         return self.still()
@@ -721,14 +771,9 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         Get large thumbnail rendition
         """
-        try:
-            return self.renditions.filter(use='thumbnail', width__gte=80).order_by('-created')[0]
-        except IndexError:
-            pass
-        try:
-            return self.renditions.filter(use='thumbnail').order_by('-created')[0]
-        except IndexError:
-            pass
+        thumb = self.findRendition(use='thumbnail', min_width=80) or self.findRendition(use='thumbnail')
+        if thumb is not None:
+            return thumb
         if self.kind == '*':
             return MediaItemRendition(name="Unknown Attachment", url="/static/img/unknown.gif", fake=True)
         return self.still()
@@ -737,15 +782,13 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         """
         Get any image with width same or larger than <size>
         """
-        try:
-            return self.renditions.filter(use__in = ('thumbnail', 'image'), width__gte=size).order_by('width', '-created')[0]
-        except IndexError:
-            pass
-
+        image = self.findRendition(use=('thumbnail', 'image'), min_width=size, order=('width', '-created'))
+        if image is not None:
+            return image
         return self.still()
 
     def video_url(self, quality="480p", request=None):
-        video = self.renditions.filter(kind="V", name=quality).order_by('-id').first()
+        video = self.findRendition(kind="V", name=quality, order=('-id',))
         if video is None:
             video = self.original()
             if video is None:
@@ -753,7 +796,7 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         return video.view_url(request=request, expires=None)
 
     def image_url(self, request=None):
-        image = self.renditions.filter(kind="I", use="thumbnail").order_by('-width').first()
+        image = self.findRendition(kind="I", use="thumbnail", order=('-width',))
         if image is None:
             image = self.original()
             if image is None:
@@ -784,9 +827,9 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
     def getImageRendition(self, width=640, name=None, use="thumbnail", request=None, flat=True):
         image = None
         if name is None:
-            image = self.renditions.filter(kind="I", use=use, width__lte=width).order_by('-width').first()
+            image = self.findRendition(kind="I", use=use, max_width=width, order=('-width',))
         else:
-            image = self.renditions.filter(kind="I", name=name).order_by('-width').first()
+            image = self.findRendition(kind="I", name=name, order=('-width',))
         if image is None:
             return None
         if not flat:
@@ -801,7 +844,7 @@ class MediaItem(models.Model, RestModel, MetaDataModel):
         }
 
     def getVideoRendition(self, height=640, request=None, flat=True):
-        video = self.renditions.filter(kind="V", use="video", height__lte=height).order_by('-height').first()
+        video = self.findRendition(kind="V", use="video", max_height=height, order=('-height',))
         if not flat:
             return video
         if video:
@@ -1084,6 +1127,16 @@ class MediaItemRendition(models.Model):
     def __bool__(self):
         return not self._fake
 
+    def save(self, *args, **kwargs):
+        ret = super(MediaItemRendition, self).save(*args, **kwargs)
+        self.clearItemCache()
+        return ret
+
+    def clearItemCache(self):
+        # keep the loaded item's rendition index in sync
+        if MediaItemRendition.mediaitem.is_cached(self):
+            self.mediaitem.clearRenditionCache()
+
     def __str__(self):
         try:
             return str(self.mediaitem) + ": " + self.name
@@ -1251,6 +1304,7 @@ class MediaItemRendition(models.Model):
         """
         if self.url.startswith(self.mediaitem.default_store()):
             stores.delete(self.url)
+        self.clearItemCache()
         return super(MediaItemRendition, self).delete()
 
     def set_meta(self, key, value):
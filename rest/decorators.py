@@ -1,8 +1,9 @@
 import sys
 
 from functools import wraps
-from django.urls import URLResolver
+from django.urls import URLResolver, URLPattern, Resolver404, ResolverMatch
 from django.urls import re_path
+from django.urls.resolvers import RegexPattern
 from django.shortcuts import Http404
 from django.http import HttpResponseRedirect
 from django.utils.cache import patch_cache_control, add_never_cache_headers, patch_vary_headers
@@ -97,19 +98,16 @@ def rest_error_catcher(func, request, *args, **kwargs):
 
 
 def dispatcher(request, *args, **kwargs):
-    module = kwargs.pop('__MODULE')
-    pattern = kwargs.pop('__PATTERN')
+    kwargs.pop('__MODULE')
+    kwargs.pop('__PATTERN')
+    # method -> handler for this pattern
+    handlers = kwargs.pop('__ROUTE')
     method = request.method
-    if request.method == 'HEAD':
+    if method == 'HEAD':
         method = 'GET'
-    key = pattern + '__' + method
-    if key in module.urlpattern_methods:
-        return rest_error_catcher(module.urlpattern_methods[key], request, *args, **kwargs)
-    method = "ALL"
-    key = pattern + '__' + method
-    if key in module.urlpattern_methods:
-        return rest_error_catcher(module.urlpattern_methods[key], request, *args, **kwargs)
-    # print module.urlpattern_methods
+    handler = handlers.get(method, None) or handlers.get("ALL", None)
+    if handler is not None:
+        return rest_error_catcher(handler, request, *args, **kwargs)
     return restStatus(request, False, error="endpoint not found", error_code=404)
 
 
@@ -117,12 +115,8 @@ def _url_method(pattern, method=None, *args, **kwargs):
     """
     Register a view handler for a specific HTTP method
     """
-    caller_filename = sys._getframe(2).f_code.co_filename
-    module = None
-    for m in list(sys.modules.values()):
-        if m and '__file__' in m.__dict__ and m.__file__ is not None and m.__file__.startswith(caller_filename):
-            module = m
-            break
+    # the module being imported is already in sys.modules
+    module = sys.modules.get(sys._getframe(2).f_globals.get("__name__"), None)
 
     def _wrapper(f):
         new_pattern = True
@@ -147,11 +141,13 @@ def _url_method(pattern, method=None, *args, **kwargs):
                 rpc_root_module.urlpatterns = []
             if lmethod and 'urlpattern_methods' not in rpc_root_module.__dict__:
                 rpc_root_module.urlpattern_methods = {}
+                rpc_root_module.urlpattern_routes = {}
             elif lmethod and pattern + '__' in rpc_root_module.urlpattern_methods:
                 new_pattern = False
 
             if lmethod:
                 rpc_root_module.urlpattern_methods[pattern + '__' + lmethod] = f
+                rpc_root_module.urlpattern_routes.setdefault(pattern, {})[lmethod] = f
 
             if new_pattern:
                 if lmethod:
@@ -162,6 +158,7 @@ def _url_method(pattern, method=None, *args, **kwargs):
                         kwargs['kwargs'] = {}
                     kwargs['kwargs']['__MODULE'] = rpc_root_module
                     kwargs['kwargs']['__PATTERN'] = pattern
+                    kwargs['kwargs']['__ROUTE'] = rpc_root_module.urlpattern_routes[pattern]
                 else:
                     func = f
                 if type(pattern) not in [str, str]:
@@ -233,6 +230,91 @@ def include_urlpatterns(regex, module):
     return [URLResolver(regex, module)]
 
 
+# regex chars that end the literal start of a pattern
+ROUTE_META = set(".^$*+?{}[]|()\\")
+
+
+def routeSegment(regex):
+    """
+    returns the literal first path segment a regex pattern matches or None
+    ie r'^member/(?P<pk>\d+)$' -> "member"
+    """
+    if "|" in regex or not regex.startswith("^"):
+        return None
+    literal = []
+    for c in regex[1:]:
+        if c in "/$":
+            return "".join(literal)
+        if c in ROUTE_META:
+            return None
+        literal.append(c)
+    # only a prefix, ie r'^member' also matches "members"
+    return None
+
+
+class RouteResolver(URLResolver):
+    """
+    URLResolver that only tries the patterns whose literal first path segment
+    matches the request, instead of every regex in the module
+    """
+    def _buildRoutes(self):
+        self._routes = {}
+        self._wildcards = []
+        for index, pattern in enumerate(self.url_patterns):
+            segment = None
+            if isinstance(pattern, URLPattern) and isinstance(pattern.pattern, RegexPattern):
+                segment = routeSegment(str(pattern.pattern._regex))
+            if segment is None:
+                self._wildcards.append((index, pattern))
+            else:
+                self._routes.setdefault(segment, []).append((index, pattern))
+        # keep registration order when merging with the wildcard patterns
+        for segment, patterns in self._routes.items():
+            self._routes[segment] = [p for i, p in sorted(patterns + self._wildcards, key=lambda x: x[0])]
+        self._wildcards = [p for i, p in self._wildcards]
+        self._route_count = len(self.url_patterns)
+
+    def getCandidates(self, path):
+        if getattr(self, "_route_count", None) != len(self.url_patterns):
+            self._buildRoutes()
+        return self._routes.get(path.split("/", 1)[0], self._wildcards)
+
+    def resolve(self, path):
+        # same as URLResolver.resolve but only walks the candidate patterns
+        path = str(path)
+        tried = []
+        match = self.pattern.match(path)
+        if match:
+            new_path, args, kwargs = match
+            for pattern in self.getCandidates(new_path):
+                try:
+                    sub_match = pattern.resolve(new_path)
+                except Resolver404 as e:
+                    self._extend_tried(tried, pattern, e.args[0].get('tried'))
+                else:
+                    if sub_match:
+                        sub_match_dict = {**kwargs, **self.default_kwargs}
+                        sub_match_dict.update(sub_match.kwargs)
+                        sub_match_args = sub_match.args
+                        if not sub_match_dict:
+                            sub_match_args = args + sub_match.args
+                        current_route = '' if isinstance(pattern, URLPattern) else str(pattern.pattern)
+                        self._extend_tried(tried, pattern, sub_match.tried)
+                        return ResolverMatch(
+                            sub_match.func,
+                            sub_match_args,
+                            sub_match_dict,
+                            sub_match.url_name,
+                            [self.app_name] + sub_match.app_names,
+                            [self.namespace] + sub_match.namespaces,
+                            self._join_route(current_route, sub_match.route),
+                            tried,
+                        )
+                    tried.append([pattern])
+            raise Resolver404({'tried': tried, 'path': new_path})
+        raise Resolver404({'path': path})
+
+
 #
 # patched django decorators check if return is httpresponse
 #
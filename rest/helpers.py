@@ -4,11 +4,15 @@ import time
 from datetime import date, datetime, timedelta
 from django.conf import settings
 import importlib
-from django.db.models import Count, Q, Avg, Sum, Max, Min
+from django.db.models import Count, Q, Avg, Sum, Max, Min, Case, When, Value
 from django.db.models.query import QuerySet
+from django.db import connections
+from django.core.exceptions import EmptyResultSet
 from io import StringIO
 import base64
 import binascii
+import hashlib
+import json
 
 from .uberdict import UberDict
 from .datem import *
@@ -33,6 +37,8 @@ AUDITLOG_LOGGER_BY_USER = getattr(settings, "AUDITLOG_LOGGER_BY_USER", False)
 AUDITLOG_LOGGER_BY_TERMINAL = getattr(settings, "AUDITLOG_LOGGER_BY_TERMINAL", False)
 AUDITLOG_LOGGERS = getattr(settings, "AUDITLOG_LOGGERS", {})
 HELPER_CACHE = UberDict()
+# counts estimated below this are done exactly
+ESTIMATE_COUNT_THRESHOLD = getattr(settings, "REST_ESTIMATE_COUNT_THRESHOLD", 100000)
 
 def getLoggerByRequest(request):
     logger = AUDIT_LOGGER
@@ -480,6 +486,174 @@ def getSum(qset, *args):
     return results
 
 
+def getQueryCacheKey(qset, kind="count"):
+    # key for a queryset based on its filters, ordering is ignored
+    try:
+        sql, params = qset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    digest = hashlib.md5("{}|{}".format(sql, params).encode("utf-8")).hexdigest()
+    return "restcache:{}:{}:{}".format(qset.model._meta.label_lower, kind, digest)
+
+
+def _cacheDefault(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime):
+        return time.mktime(obj.timetuple())
+    if isinstance(obj, date):
+        return obj.strftime("%Y/%m/%d")
+    return str(obj)
+
+
+def getCachedResult(key, ttl, func):
+    """
+    returns the json cached value of key in redis or calls func and caches the result for ttl seconds,
+    hits and misses both return the value as read back from json
+    """
+    if not key or not ttl:
+        return func()
+    try:
+        from ws4redis.redis import getRedisClient
+        client = getRedisClient()
+        value = client.get(key)
+    except Exception:
+        log_exception("cache get failed", key)
+        return func()
+    if value is not None:
+        return json.loads(value)
+    # a miss returns the same json types as a hit
+    value = json.dumps(func(), default=_cacheDefault)
+    try:
+        client.setex(key, int(ttl), value)
+    except Exception:
+        log_exception("cache set failed", key)
+    return json.loads(value)
+
+
+def getEstimatedCount(qset, threshold=None):
+    """
+    returns the planner estimate of the number of rows in qset,
+    estimates below threshold or on unsupported databases fall back to an exact count
+    """
+    if threshold is None:
+        threshold = ESTIMATE_COUNT_THRESHOLD
+    query = qset.query
+    if query.distinct or query.low_mark or query.high_mark is not None:
+        return qset.count()
+    estimate = None
+    connection = connections[qset.db]
+    try:
+        with connection.cursor() as cursor:
+            if not query.where and connection.vendor in ("postgresql", "mysql"):
+                # unfiltered, use the table statistics
+                if connection.vendor == "postgresql":
+                    cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [qset.model._meta.db_table])
+                else:
+                    cursor.execute("SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s", [qset.model._meta.db_table])
+                row = cursor.fetchone()
+                if row and row[0] is not None:
+                    estimate = int(row[0])
+            elif connection.vendor == "postgresql":
+                sql, params = qset.order_by().values("pk").query.sql_with_params()
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]["Plan"]["Plan Rows"])
+    except EmptyResultSet:
+        return 0
+    except Exception:
+        log_exception("count estimate failed", qset.model._meta.db_table)
+    if estimate is None or estimate < threshold:
+        return qset.count()
+    return estimate
+
+
+def getCount(qset, estimate=False, cache_ttl=0):
+    """
+    returns the count of qset
+    estimate: use planner statistics for large results, if an int it is the threshold for exact counts
+    cache_ttl: seconds to cache the count in redis by the queryset filters
+    """
+    if estimate:
+        threshold = estimate if type(estimate) is int else None
+        func = lambda: getEstimatedCount(qset, threshold)
+    else:
+        func = qset.count
+    if not cache_ttl:
+        return func()
+    return getCachedResult(getQueryCacheKey(qset, "count"), cache_ttl, func)
+
+
+# removes the flushed members of KEYS[1] whose score is still the flushed one
+# ARGV is member, score pairs
+FLUSHED_TIMESTAMPS_SCRIPT = """
+local removed = 0
+for i = 1, #ARGV, 2 do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[i + 1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+
+def bufferTimestamp(key, pk, when=None):
+    """
+    records when (epoch, default now) for pk in the redis sorted set key
+    and in key:pending, flushTimestamps writes the pending ones to the database in bulk
+    """
+    from ws4redis.redis import getRedisClient
+    if when is None:
+        when = time.time()
+    pipe = getRedisClient().pipeline(transaction=False)
+    pipe.zadd(key, {pk: when})
+    pipe.zadd(F"{key}:pending", {pk: when})
+    pipe.execute()
+
+
+def getBufferedTimestamp(key, pk):
+    # returns the buffered datetime for pk or None
+    from ws4redis.redis import getRedisClient
+    score = getRedisClient().zscore(key, pk)
+    if score is None:
+        return None
+    return datetime.fromtimestamp(score)
+
+
+def getBufferedSince(key, seconds):
+    # returns the pks with a buffered timestamp in the last seconds
+    from ws4redis.redis import getRedisClient
+    pks = getRedisClient().zrangebyscore(key, time.time() - seconds, "+inf")
+    return [pk.decode() for pk in pks]
+
+
+def flushTimestamps(key, model, field, keep=0, chunk_size=500):
+    """
+    writes the pending buffered timestamps to model.field using one
+    UPDATE ... CASE per chunk, entries older than keep seconds are then dropped
+    returns the number of rows updated
+    """
+    from ws4redis.redis import getRedisClient
+    client = getRedisClient()
+    now = time.time()
+    pending = F"{key}:pending"
+    entries = client.zrange(pending, 0, -1, withscores=True)
+    script = client.register_script(FLUSHED_TIMESTAMPS_SCRIPT)
+    count = 0
+    for i in range(0, len(entries), chunk_size):
+        chunk = entries[i:i + chunk_size]
+        whens = [When(pk=pk.decode(), then=Value(datetime.fromtimestamp(score))) for pk, score in chunk]
+        values = Case(*whens, output_field=model._meta.get_field(field))
+        count += model.objects.filter(pk__in=[pk.decode() for pk, score in chunk]).update(**{field: values})
+        # entries touched again since the read keep their newer score and stay pending
+        script(keys=[pending], args=[v for pk, score in chunk for v in (pk, score)])
+    client.zremrangebyscore(key, "-inf", now - keep)
+    return count
+
+
 def countOccurences(qset, field_name):
     output = UberDict()
     for item in list(qset.values(field_name).annotate(count=Count(field_name))):
@@ -36,12 +36,25 @@ class JWToken():
         if self._is_valid is not None:
             return self._is_valid
         try:
-            objict.fromdict(jwt.decode(self.token, self.key, algorithms=self.alg))
+            self.payload = objict.fromdict(jwt.decode(self.token, self.key, algorithms=self.alg))
             self._is_valid = True
         except Exception:
             self._is_valid = False
         return self._is_valid
 
+    @classmethod
+    def fromVerified(cls, token, payload, key=JWT_KEY, alg="HS256"):
+        # rebuild an already verified token without decoding it again
+        obj = cls.__new__(cls)
+        obj.token = token
+        obj.key = key
+        obj.alg = alg
+        obj.access_expires_in = JWT_EXP_DEFAULT
+        obj.refresh_expires_in = JWT_EXP_7_DAY
+        obj.payload = objict.fromdict(payload)
+        obj._is_valid = True
+        return obj
+
     @property
     def session_id(self):
         if self.payload:
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.urls import URLResolver, URLPattern, Resolver404
+from django.urls.resolvers import RegexPattern
+import re
+import time
+
+from rest import urls
+from rest.decorators import RouteResolver
+
+GROUP_RE = re.compile(r"\(\?P<\w+>[^)]*\)[?*+]?")
+
+
+def samplePath(regex):
+    # turn a pattern into a path it matches, named groups become "1"
+    path = GROUP_RE.sub("1", regex).lstrip("^").rstrip("$")
+    if re.search(r"[\\.*+?{}\[\]|()]", path):
+        return None
+    return path
+
+
+class Command(BaseCommand):
+    help = "Compare resolving the rpc urls with RouteResolver against Django's URLResolver"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loops", type=int, default=100)
+
+    def handle(self, *args, **options):
+        resolvers = [p for p in urls.urlpatterns if isinstance(p, RouteResolver)]
+        plain = [URLResolver(r.pattern, r.urlconf_name) for r in resolvers]
+        paths = []
+        for resolver in resolvers:
+            prefix = str(resolver.pattern)
+            for pattern in resolver.url_patterns:
+                if isinstance(pattern, URLPattern) and isinstance(pattern.pattern, RegexPattern):
+                    path = samplePath(pattern.pattern._regex)
+                    if path is not None:
+                        paths.append(prefix + path)
+        print("{} apps, {} sample paths".format(len(resolvers), len(paths)))
+
+        def resolve(table, path):
+            for resolver in table:
+                try:
+                    return resolver.resolve(path)
+                except Resolver404:
+                    pass
+            return None
+
+        for path in paths:
+            a, b = resolve(plain, path), resolve(resolvers, path)
+            if (a and a.func, a and a.kwargs) != (b and b.func, b and b.kwargs):
+                print("MISMATCH {}: {} != {}".format(path, a, b))
+
+        for name, table in [("URLResolver", plain), ("RouteResolver", resolvers)]:
+            start = time.perf_counter()
+            for i in range(options["loops"]):
+                for path in paths:
+                    resolve(table, path)
+            elapsed = time.perf_counter() - start
+            count = max(1, options["loops"] * len(paths))
+            print("{:14} {:.3f}s  {:.1f}us/resolve".format(name, elapsed, elapsed * 1000000 / count))
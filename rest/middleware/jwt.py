@@ -10,8 +10,84 @@ from django.utils.cache import patch_vary_headers
 from http.cookies import Morsel
 Morsel._reserved['samesite'] = 'SameSite'
 
+import time
+
 JWT_COOKIE_KEY = getattr(settings, "JWT_COOKIE_KEY", "JWT_TOKEN")
 JWT_ALLOW_COOKIE = getattr(settings, "JWT_ALLOW_COOKIE", False)
+# seconds a verified token is reused without checking its signature again, 0 disables
+JWT_CACHE_TTL = getattr(settings, "JWT_CACHE_TTL", 60)
+JWT_CACHE_SIZE = getattr(settings, "JWT_CACHE_SIZE", 10000)
+
+# token -> (expires, payload, member pk, security token the signature was checked with)
+JWT_CACHE = dict()
+
+
+def _loadUser(member):
+    # the User row is loaded with the Member (multi table inheritance), no query needed
+    User = apps.get_model("account", "User")
+    fields = [f.attname for f in User._meta.concrete_fields]
+    return User.from_db(member._state.db, fields, [getattr(member, f) for f in fields])
+
+
+def _getCachedJWT(token):
+    entry = JWT_CACHE.get(token, None)
+    if entry is None:
+        return None, None
+    expires, payload, member_pk, key = entry
+    if expires < time.time():
+        JWT_CACHE.pop(token, None)
+        return None, None
+    member = apps.get_model("account", "Member").objects.filter(pk=member_pk).first()
+    if member is None or member.security_token != key:
+        # security token rotated, all tokens signed with the old one are invalid
+        JWT_CACHE.pop(token, None)
+        return None, None
+    return JWToken.fromVerified(token, payload, key), member
+
+
+def _setCachedJWT(token, member):
+    if not JWT_CACHE_TTL:
+        return
+    expires = time.time() + JWT_CACHE_TTL
+    if token.payload.exp:
+        expires = min(expires, token.payload.exp)
+    if len(JWT_CACHE) >= JWT_CACHE_SIZE:
+        now = time.time()
+        for key in [k for k, v in list(JWT_CACHE.items()) if v[0] < now]:
+            JWT_CACHE.pop(key, None)
+        if len(JWT_CACHE) >= JWT_CACHE_SIZE:
+            JWT_CACHE.clear()
+    JWT_CACHE[token.token] = (expires, dict(token.payload), member.pk, token.key)
+
+
+def getMemberFromJWT(token, request=None):
+    """
+    Verify a raw JWT and return (JWToken, Member) or (None, reason).
+    The verified claims are cached for JWT_CACHE_TTL, the member is always loaded fresh.
+    """
+    jwt_token, member = _getCachedJWT(token)
+    if jwt_token is None:
+        jwt_token = JWToken(token)
+        if jwt_token.payload is None:
+            return None, "invalid jwt token"
+        User = apps.get_model("account", "User")
+        user = User.objects.filter(pk=jwt_token.payload.user_id).last()
+        if user is None:
+            return None, "invalid jwt user"
+        member = user.getMember()
+        if member.security_token is None:
+            member.security_token = JWT_KEY
+            member.save()
+        # set the token key to the member security token, this lets us invalidate tokens
+        jwt_token.key = member.security_token
+        if not jwt_token.is_valid:
+            return None, "invalid jwt"
+        _setCachedJWT(jwt_token, member)
+    if not jwt_token.isExpired():
+        return None, "expired jwt"
+    if not member.canLogin(request, False):
+        return None, "user cannot login via jwt"
+    return jwt_token, member
 
 
 class JWTokenMiddleware(object):
@@ -62,40 +138,13 @@ class JWTokenMiddleware(object):
 
     def process_jwt(self, request):
         # this is JWT so let us authenticate
-        token = JWToken(request.token)
-        if token.payload is None:
-            helpers.log_error("invalid jwt token", request.token)
-            request.token = None
-            request.token_bearer = None
-            return
-        User = apps.get_model("account", "User")
-        user = User.objects.filter(pk=token.payload.user_id).last()
-        if user is None:
-            helpers.log_error("invalid jwt user", request.token)
-            request.token = None
-            request.token_bearer = None
-            return
-        member = user.getMember()
-        if member.security_token is None:
-            member.security_token = JWT_KEY
-            member.save()
-        # set the token key to the member security token, this lets us invalidate tokens
-        token.key = member.security_token
-        if not token.is_valid:
-            helpers.log_error("invalid jwt", request.token)
-            request.token = None
-            request.token_bearer = None
-            return
-        if not token.isExpired():
-            helpers.log_error("expired jwt", request.token)
-            request.token = None
-            request.token_bearer = None
-            return
-        if not member.canLogin(request, False):
-            helpers.log_error("user cannot login via jwt", request.token)
+        token, member = getMemberFromJWT(request.token, request)
+        if token is None:
+            helpers.log_error(member, request.token)
             request.token = None
             request.token_bearer = None
             return
+        user = _loadUser(member)
         request.jwt = token
         request.user = user
         request.member = member
@@ -1,5 +1,6 @@
 from importlib import import_module
 from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
 from django.utils.cache import patch_vary_headers
 from django.utils.http import http_date
 from rest import ua
@@ -10,6 +11,9 @@ import time
 from http.cookies import Morsel
 Morsel._reserved['samesite'] = 'SameSite'
 SESSION_COOKIE_SAMESITE = getattr(settings, "SESSION_COOKIE_SAMESITE", None)
+# unchanged sessions are saved again (extending their expiry) after this many seconds
+SESSION_REFRESH_SECS = getattr(settings, "SESSION_REFRESH_SECS", 900)
+SESSION_REFRESH_KEY = "_session_refreshed"
 
 
 class SimpleSessionMiddleware(object):
@@ -32,6 +36,16 @@ class SimpleSessionMiddleware(object):
         request.session = self.SessionStore(session_key)
         # helpers.log_error("session keys", session_key, request.session.session_key)
 
+    def needsSave(self, session):
+        # only write sessions that changed or are due for an expiry refresh
+        if session.modified or settings.SESSION_SAVE_EVERY_REQUEST:
+            return True
+        if not session.accessed or session.session_key is None:
+            # never loaded (nothing to refresh) or new and empty
+            return False
+        refreshed = session.get(SESSION_REFRESH_KEY, 0)
+        return time.time() - refreshed > SESSION_REFRESH_SECS
+
     def process_response(self, request, response):
         if response.status_code == 500:
             return response
@@ -41,7 +55,15 @@ class SimpleSessionMiddleware(object):
         # print("session max_age: {}".format(max_age))
         expires = None
         max_age = None
-        request.session.save()
+        if not self.needsSave(request.session):
+            return response
+        request.session[SESSION_REFRESH_KEY] = int(time.time())
+        try:
+            request.session.save()
+        except UpdateError:
+            # expired or deleted (ie logout) during the request, like django's
+            # middleware do not bring it back, the next request starts a new one
+            return response
         session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
         if session_key == request.session.session_key:
             return response
@@ -4,12 +4,14 @@ from django.core.exceptions import FieldDoesNotExist
 from hashids import Hashids
 import hashlib
 import string
+import json
+import time
 
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 TWOPLACES = Decimal(10) ** -2
 
-from django.db import models
+from django.db import models, transaction
 from django.apps import apps
 get_model = apps.get_model
 
@@ -194,24 +196,48 @@ class MetaDataModel(object):
         # this will remove all properties
         # if category is not it will remove all properties
         self.properties.filter(category=category).delete()
+        self.clearPropertyCache()
+
+    def getPropertyMap(self):
+        """
+        returns {(category, key): property} loaded with one query (or from prefetch_related("properties"))
+        and kept on the instance, setProperty/setProperties keep it up to date
+        """
+        props = getattr(self, "_property_map", None)
+        if props is None:
+            props = {}
+            for p in self.properties.all():
+                props[(p.category, p.key)] = p
+            self._property_map = props
+        return props
+
+    def clearPropertyCache(self):
+        self._property_map = None
+        prefetched = getattr(self, "_prefetched_objects_cache", None)
+        if prefetched:
+            prefetched.pop("properties", None)
 
     def getProperties(self, category=None):
+        self.__initFieldProps()
         ret = {}
-        for p in self.properties.all():
+        for p in list(self.getPropertyMap().values()):
             if p.category:
-                props = self.getFieldProps(p.category)
-                if props.hidden:
-                    continue
+                if self.__field_props:
+                    props = self.getFieldProps(p.category)
+                    if props.hidden:
+                        continue
                 if p.category not in ret or not isinstance(ret.get(p.category, None), dict):
                     ret[p.category] = {}
-                props = self.getFieldProps("{}.{}".format(p.category, p.key))
-                if props.hidden:
-                    continue
+                if self.__field_props:
+                    props = self.getFieldProps("{}.{}".format(p.category, p.key))
+                    if props.hidden:
+                        continue
                 ret[p.category][p.key] = p.getValue()
             else:
-                props = self.getFieldProps(p.key)
-                if props.hidden:
-                    continue
+                if self.__field_props:
+                    props = self.getFieldProps(p.key)
+                    if props.hidden:
+                        continue
                 ret[p.key] = p.getValue()
         if category is not None:
             if category in ret:
@@ -220,7 +246,7 @@ class MetaDataModel(object):
         return ret
 
     def __initFieldProps(self):
-        if not hasattr(self, "__field_props"):
+        if not hasattr(self, "_MetaDataModel__field_props"):
             if hasattr(self.RestMeta, "METADATA_FIELD_PROPERTIES"):
                 # this provides extra protection for metadata fields
                 self.__field_props = self.RestMeta.METADATA_FIELD_PROPERTIES
@@ -276,8 +302,69 @@ class MetaDataModel(object):
         raise PermisionDeniedException(subject)
 
     def setProperties(self, data, category=None, request=None, using=None):
-        for k,v in list(data.items()):
-            self.setProperty(k, v, category, request=request, using=using)
+        """
+        sets many properties at once, plain keys are diffed against the property map
+        and written with bulk_create/bulk_update in one transaction,
+        keys with field properties (requires, notify, on_change) go through setProperty
+        """
+        if not using:
+            using = getattr(self.RestMeta, "DATABASE", using)
+        self.__initFieldProps()
+        props = self.getPropertyMap()
+        PropClass = self.get_fk_model("properties")
+        creates = []
+        updates = []
+        deletes = []
+        changed = []
+        for key, value in list(data.items()):
+            full_key = "{}.{}".format(category, key) if category else key
+            if isinstance(value, dict) or "." in key or (self.__field_props and self.getFieldProps(full_key)):
+                self.setProperty(key, value, category, request=request, using=using)
+                continue
+            prop = props.get((category, key), None)
+            old_value = None
+            if prop is None:
+                if value is None or value == "":
+                    continue
+                prop = PropClass(parent=self, key=key, category=category)
+                prop.setValue(value)
+                creates.append(prop)
+            elif value is None or value == "":
+                old_value = prop.getValue()
+                deletes.append(prop)
+            elif "{}".format(value) != prop.value:
+                old_value = prop.getValue()
+                prop.setValue(value)
+                updates.append(prop)
+            else:
+                continue
+            changed.append((full_key, old_value))
+
+        if not creates and not updates and not deletes:
+            return
+        with transaction.atomic(using=using):
+            if category and (None, category) in props:
+                # same as setProperty, a plain key with the category name is replaced by the category
+                self.properties.filter(key=category).delete()
+                del props[(None, category)]
+            if deletes:
+                PropClass.objects.using(using).filter(pk__in=[p.pk for p in deletes]).delete()
+            if updates:
+                PropClass.objects.using(using).bulk_update(updates, ["value", "value_format", "int_value", "float_value"])
+            if creates:
+                PropClass.objects.using(using).bulk_create(creates)
+        for prop in deletes:
+            props.pop((prop.category, prop.key), None)
+        for prop in creates:
+            props[(prop.category, prop.key)] = prop
+        if creates and creates[0].pk is None:
+            # the database did not return the new ids
+            self.clearPropertyCache()
+        if category == "permissions":
+            self.clearPermissionCache(using=using)
+        if hasattr(self, "_recordRestChange"):
+            for full_key, old_value in changed:
+                self._recordRestChange("metadata.{}".format(full_key), old_value)
 
     def setProperty(self, key, value, category=None, request=None, using=None, ascii_only=False):
         # rest_helpers.log_print("{}:{} ({})".format(key, value, type(value)))
@@ -305,7 +392,9 @@ class MetaDataModel(object):
             # this deletes anything with the key that matches the category
             # this works because the category is stored not in key but category field
             # rest_helpers.log_print("deleting key={}".format(category))
-            self.properties.filter(key=category).delete()
+            if (None, category) in self.getPropertyMap():
+                self.properties.filter(key=category).delete()
+                del self.getPropertyMap()[(None, category)]
         else:
             full_key = key
 
@@ -315,13 +404,14 @@ class MetaDataModel(object):
 
         check_value = "{}".format(value)
         has_changed = False
-        prop = self.properties.filter(category=category, key=key).last()
+        prop = self.getPropertyMap().get((category, key), None)
         old_value = None
         if prop:
             # existing property we need to make sure we delete
             old_value = prop.getValue()
             if value is None or value == "":
                 prop.delete()
+                self.getPropertyMap().pop((category, key), None)
                 has_changed = True
             else:
                 has_changed = check_value != prop.value
@@ -342,7 +432,11 @@ class MetaDataModel(object):
             # rest_helpers.log_print(u"saving {}.{}".format(category, key))
             # rest_helpers.log_print(u"saving {} : {}".format(full_key, value))
             prop.save(using=using)
+            self.getPropertyMap()[(category, key)] = prop
 
+        if category == "permissions" or key == "permissions":
+            # after the write so other processes cannot cache the old set under the new version
+            self.clearPermissionCache(using=using)
         if hasattr(self, "_recordRestChange"):
             self._recordRestChange("metadata.{}".format(full_key), old_value)
 
@@ -365,11 +459,89 @@ class MetaDataModel(object):
         try:
             if "." in key:
                 category, key = key.split('.')
-            return self.properties.get(category=category, key=key).getValue(field_type)
+            prop = self.getPropertyMap().get((category, key), None)
+            if prop is not None:
+                return prop.getValue(field_type)
         except:
             pass
         return default
 
+    def _permissionCacheKey(self):
+        return "permissions:{}:{}".format(self._meta.label_lower, self.pk)
+
+    def _queryPermissionSet(self):
+        perms = []
+        for (category, key), prop in list(self.getPropertyMap().items()):
+            if category == "permissions" and prop.getValue(bool):
+                perms.append(key)
+        return frozenset(perms)
+
+    def _loadPermissionSet(self):
+        ttl = rest_helpers.getSetting("PERMISSION_CACHE_TTL", 0)
+        if not ttl:
+            return self._queryPermissionSet()
+        # shared through redis, entries are only valid for the current version stamp
+        key = self._permissionCacheKey()
+        try:
+            from ws4redis.redis import getRedisClient
+            client = getRedisClient()
+            version, cached = client.mget(key + ":version", key)
+        except Exception:
+            rest_helpers.log_exception("permission cache get failed", key)
+            return self._queryPermissionSet()
+        version = int(version or 0)
+        if cached:
+            cached = json.loads(cached)
+            if cached.get("version") == version:
+                return frozenset(cached["perms"])
+        perms = self._queryPermissionSet()
+        try:
+            client.setex(key, ttl, json.dumps({"version": version, "perms": list(perms)}))
+        except Exception:
+            rest_helpers.log_exception("permission cache set failed", key)
+        return perms
+
+    def getPermissionSet(self):
+        # the enabled "permissions" properties, loaded once per request
+        perms = getattr(self, "_permission_set", None)
+        if perms is not None:
+            return perms
+        request = RestModel.getActiveRequest()
+        cache = None
+        if request is not None:
+            cache = getattr(request, "_permission_sets", None)
+            if cache is None:
+                cache = {}
+                request._permission_sets = cache
+            perms = cache.get(self._permissionCacheKey(), None)
+        if perms is None:
+            perms = self._loadPermissionSet()
+            if cache is not None:
+                cache[self._permissionCacheKey()] = perms
+        self._permission_set = perms
+        return perms
+
+    def clearPermissionCache(self, using=None):
+        self._permission_set = None
+        key = self._permissionCacheKey()
+        request = RestModel.getActiveRequest()
+        if request is not None and getattr(request, "_permission_sets", None):
+            request._permission_sets.pop(key, None)
+        ttl = rest_helpers.getSetting("PERMISSION_CACHE_TTL", 0)
+        if ttl:
+            # the shared version only moves once the change is visible to other processes
+            transaction.on_commit(lambda: self._bumpPermissionVersion(key, ttl), using=using)
+
+    def _bumpPermissionVersion(self, key, ttl):
+        try:
+            from ws4redis.redis import getRedisClient
+            client = getRedisClient()
+            # a new stamp, never one an older cache entry could still carry,
+            # it outlives every entry written before it (same ttl, set later)
+            client.set(key + ":version", time.time_ns(), ex=ttl)
+        except Exception:
+            rest_helpers.log_exception("permission cache clear failed", key)
+
 
 class RestModel(object):
     class __RestMeta__:
@@ -429,6 +601,10 @@ class RestModel(object):
                 if f.name not in no_show_fields:
                     field_names.append(f.name)
 
+        # sets this graph reads, see RestMeta.PREFETCH_RELATED
+        prefetch = list(getattr(cls.RestMeta, "PREFETCH_RELATED", {}).get(name, []))
+        related_graphs = {}
+
         if "graphs" in graph and name != "basic":
             if "recurse_into" not in graph:
                 graph["recurse_into"] = []
@@ -464,6 +640,7 @@ class RestModel(object):
                 if not field or field == "self":
                     # this means it is referencing self
                     foreign_graph = cls.buildGraph(gname)
+                    prefetch.extend(foreign_graph.get("prefetch_related", []))
                     for part in foreign_graph:
                         if part not in graph:
                             graph[part] = foreign_graph[part]
@@ -486,6 +663,7 @@ class RestModel(object):
                     # print "NO getGraph"
                     continue
                 foreign_graph = ForeignModel.getGraph(gname)
+                related_graphs[field] = foreign_graph
 
                 for part in ["fields", "recurse_into", "extra", "exclude"]:
                     if part not in foreign_graph:
@@ -523,8 +701,105 @@ class RestModel(object):
 
         if "no_uscore" in graph:
             del graph["no_uscore"]
+        graph["select_related"], graph["prefetch_related"] = cls.buildQueryPlan(graph, prefetch, related_graphs)
         return graph
 
+    @classmethod
+    def buildQueryPlan(cls, graph, prefetch=[], related_graphs={}):
+        """
+        walks the recurse_into paths of a graph and returns the
+        select_related paths and prefetch_related lookups it needs
+        so that list views do not hit the db once per row
+        prefetch: extra lookups the graph itself reads
+        related_graphs: built graphs of the recursed fields, their lookups are prefetched too
+        """
+        select_related = []
+        prefetch_related = []
+        filters = graph.get("filter", {})
+        cls_db = getattr(getattr(cls, "RestMeta", None), "DATABASE", None)
+        for f in graph.get("recurse_into", []):
+            if type(f) in (list, tuple):
+                f = f[0]
+            if f[:2] == "*.":
+                f = f[2:]
+            if f.startswith("generic__"):
+                continue
+            model = cls
+            path = []
+            is_many = False
+            for name in f.split("."):
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    # properties and methods are resolved when serializing
+                    break
+                if not field.is_relation or field.related_model is None:
+                    break
+                rel_db = getattr(getattr(field.related_model, "RestMeta", None), "DATABASE", None)
+                if rel_db != cls_db:
+                    # cannot join across databases
+                    break
+                if field.many_to_many or field.one_to_many:
+                    if ".".join(path + [name]) in filters:
+                        # filtered sets are queried on their own
+                        break
+                    is_many = True
+                    if field.auto_created and not field.concrete:
+                        name = field.get_accessor_name()
+                path.append(name)
+                model = field.related_model
+            else:
+                # sets the recursed graph reads, ie media__renditions
+                sub_graph = related_graphs.get(f) if path else None
+                for lookup in (sub_graph or {}).get("prefetch_related", []):
+                    lookup = "__".join(path + [lookup])
+                    if lookup not in prefetch_related:
+                        prefetch_related.append(lookup)
+            if not path:
+                continue
+            lookup = "__".join(path)
+            if is_many:
+                if lookup not in prefetch_related:
+                    prefetch_related.append(lookup)
+            elif lookup not in select_related:
+                select_related.append(lookup)
+        # metadata is built from the properties set
+        recursed = [(f[0] if type(f) in (list, tuple) else f).lstrip("*.") for f in graph.get("recurse_into", [])]
+        for f in list(graph.get("fields", None) or []) + list(graph.get("extra", [])):
+            if type(f) in (list, tuple):
+                f = f[0]
+            if type(f) is not str:
+                continue
+            if f[:2] == "*.":
+                f = f[2:]
+            if f != "metadata" and not f.endswith(".metadata"):
+                continue
+            path = f.split(".")[:-1]
+            if path and ".".join(path) not in recursed:
+                continue
+            model = cls
+            for name in path:
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    model = None
+                    break
+                if not field.is_relation or field.many_to_many or field.one_to_many or field.related_model is None:
+                    model = None
+                    break
+                model = field.related_model
+            if model is None or not issubclass(model, MetaDataModel) or getattr(getattr(model, "RestMeta", None), "DATABASE", None) != cls_db:
+                continue
+            lookup = "__".join(path + ["properties"])
+            if lookup not in prefetch_related:
+                prefetch_related.append(lookup)
+        for lookup in prefetch:
+            if lookup not in prefetch_related:
+                prefetch_related.append(lookup)
+        # parent lookups must be prefetched before their children
+        prefetch_related.sort(key=lambda x: x.count("__"))
+        return select_related, prefetch_related
+
     @classmethod
     def ro_objects(cls):
         using = getattr(cls.RestMeta, "RO_DATABASE", None)
@@ -562,11 +837,22 @@ class RestModel(object):
         setattr(cls, graph_key, graph)
         return graph
 
+    @classmethod
+    def getGraphSerializer(cls, name):
+        # compiled version of the graph, parsed once and reused for every row
+        serializer_key = "_graph_serializer_{0}__".format(name)
+        if hasattr(cls, serializer_key):
+            return getattr(cls, serializer_key)
+        RestModel._setupGraphHelpers()
+        serializer = GRAPH_HELPERS.views.GraphSerializer(**cls.getGraph(name))
+        setattr(cls, serializer_key, serializer)
+        return serializer
+
     def toGraph(self, request=None, graph="basic"):
         RestModel._setupGraphHelpers()
         if not request:
             request = GRAPH_HELPERS.get_request()
-        return GRAPH_HELPERS.restGet(request, self, return_httpresponse=False, **self.getGraph(graph))
+        return GRAPH_HELPERS.restGet(request, self, return_httpresponse=False, serializer=self.getGraphSerializer(graph), **self.getGraph(graph))
 
     def getFieldValue(self, name, default=None):
         fields = name.split('.')
@@ -1142,7 +1428,8 @@ class RestModel(object):
                     totals[tf] = getattr(cls, cls_method)(qset, request)
         if not graph and request is not None:
             graph = request.DATA.get("graph", "default")
-        return GRAPH_HELPERS.restList(request, qset, sort=sort, totals=totals, return_httpresponse=return_httpresponse, **cls.getGraph(graph))
+        return GRAPH_HELPERS.restList(request, qset, sort=sort, totals=totals, return_httpresponse=return_httpresponse, serializer=cls.getGraphSerializer(graph), cursor=getattr(cls.RestMeta, "LIST_CURSOR_PAGING", False),
+            count_estimate=getattr(cls.RestMeta, "LIST_COUNT_ESTIMATE", False), count_cache=getattr(cls.RestMeta, "LIST_CACHE_TTL", 0), **cls.getGraph(graph))
 
     @classmethod
     def toList(cls, qset, graph=None, totals=None, request=None):
@@ -1163,7 +1450,7 @@ class RestModel(object):
         elif not graph:
             graph = "default"
         return_response = not as_dict
-        return GRAPH_HELPERS.restGet(request, self, return_httpresponse=return_response, **self.getGraph(graph))
+        return GRAPH_HELPERS.restGet(request, self, return_httpresponse=return_response, serializer=self.getGraphSerializer(graph), **self.getGraph(graph))
 
     def toDict(self, graph=None):
         RestModel._setupGraphHelpers()
@@ -1314,6 +1601,10 @@ class RestModel(object):
             return cls.on_rest_list_summary(request, qset)
         if hasattr(cls.RestMeta, "FORMATS"):
             fields =  cls.RestMeta.FORMATS.get(format)
+            if not fields and format == "ndjson":
+                fields = cls.RestMeta.FORMATS.get("json")
+            elif not fields and format in ["csv.gz", "csv.zst", "parquet", "arrow"]:
+                fields = cls.RestMeta.FORMATS.get("csv")
         else:
             no_show_fields = RestModel.__RestMeta__.NO_SHOW_FIELDS
             if hasattr(cls.RestMeta, "NO_SHOW_FIELDS"):
@@ -1326,7 +1617,7 @@ class RestModel(object):
                         fields.append(f.name)
         if fields:
             name = request.DATA.get("format_filename", None)
-            format_size = request.DATA.get("format_size", 10000)
+            format_size = request.DATA.get("format_size", 10000, field_type=int)
             if name is None:
                 name = "{}.{}".format(cls.__name__.lower(), format)
             # print "csv size: {}".format(qset.count())
@@ -1340,32 +1631,54 @@ class RestModel(object):
             cls._boundRest()
             if format == "json":
                 return GRAPH_HELPERS.views.restJSON(request, qset, fields, name, format_size)
+            elif format == "ndjson":
+                return GRAPH_HELPERS.views.restNDJSON(request, qset, fields, name, format_size)
             elif format == "csv":
                 return GRAPH_HELPERS.views.restCSV(request, qset, fields, name, format_size)
             elif format == "flat":
                 return GRAPH_HELPERS.views.restFlat(request, qset, fields, name, format_size)
+            elif format in ["csv.gz", "csv.zst"]:
+                return GRAPH_HELPERS.views.restCSVCompressed(request, qset, fields, name, format_size, method=format[4:])
+            elif format in ["parquet", "arrow"]:
+                return GRAPH_HELPERS.views.restArrow(request, qset, fields, name, format_size, format=format)
     
     @classmethod
     def on_rest_list_summary(cls, request, qset):
         if not hasattr(cls.RestMeta, "SUMMARY_FIELDS"):
             return cls.restList(request, qset, None)
         cls._boundRest()
+        cache_ttl = getattr(cls.RestMeta, "LIST_CACHE_TTL", 0)
+        key = rest_helpers.getQueryCacheKey(qset, "summary") if cache_ttl else None
+        output = rest_helpers.getCachedResult(key, cache_ttl, lambda: cls.getListSummary(qset))
+        return GRAPH_HELPERS.restGet(request, UberDict(output))
+
+    @classmethod
+    def getListSummary(cls, qset):
+        # aggregates the RestMeta.SUMMARY_FIELDS for qset in a single query
         summary_info = getattr(cls.RestMeta, "SUMMARY_FIELDS")
-        output = UberDict()
-        output.count = qset.count()
+        aggs = {}
+        labels = []
+        separate = []
+
+        def addAggregate(lbl, agg, default):
+            alias = "summary_{}".format(len(labels))
+            aggs[alias] = agg
+            labels.append((alias, lbl, default))
+
+        addAggregate("count", models.Count("pk"), 0)
         for key, value in list(summary_info.items()):
-            if key == "sum":
-                res = rest_helpers.getSum(qset, *value)
-                if isinstance(res, dict):
-                    output.update(res)
-                else:
-                    output[value[0]] = res
-            elif key == "avg":
-                for f in value:
-                    output["avg_{}".format(f)] = rest_helpers.getAverage(qset, f)
-            elif key == "max":
+            if key in ("sum", "avg", "max"):
                 for f in value:
-                    output["max_{}".format(f)] = rest_helpers.getMax(qset, f)
+                    lbl = f if key == "sum" else "{}_{}".format(key, f)
+                    if cls._isManyLookup([f]):
+                        # a to-many join would repeat rows for every other aggregate
+                        separate.append((lbl, key, f, {}))
+                    elif key == "sum":
+                        addAggregate(lbl, models.Sum(f), 0)
+                    elif key == "avg":
+                        addAggregate(lbl, models.Avg(f), 0.0)
+                    else:
+                        addAggregate(lbl, models.Max(f), 0.0)
             elif isinstance(value, dict):
                 if "|" in key:
                     fields = key.split("|")
@@ -1379,16 +1692,57 @@ class RestModel(object):
                     action = "count"
                     lbl = key
                     field = None
-                act_qset = qset.filter(**value)
+                if action not in ("count", "sum", "avg", "max"):
+                    continue
+                if cls._isManyLookup(value) or (field and cls._isManyLookup([field])):
+                    # joins across many relations would repeat rows, filter these separately
+                    separate.append((lbl, action, field, value))
+                    continue
+                cond = models.Q(**value)
                 if action == "count":
-                    output[lbl] = act_qset.count()
+                    addAggregate(lbl, models.Count("pk", filter=cond), 0)
                 elif action == "sum":
-                    output[lbl] = rest_helpers.getSum(act_qset, field)
+                    addAggregate(lbl, models.Sum(field, filter=cond), 0)
                 elif action == "avg":
-                    output[lbl] = rest_helpers.getAverage(act_qset, field)
+                    addAggregate(lbl, models.Avg(field, filter=cond), 0.0)
                 elif action == "max":
-                    output[lbl] = rest_helpers.getMax(act_qset, field)
-        return GRAPH_HELPERS.restGet(request, output)
+                    addAggregate(lbl, models.Max(field, filter=cond), 0.0)
+
+        res = qset.aggregate(**aggs)
+        output = UberDict()
+        for alias, lbl, default in labels:
+            value = res.get(alias)
+            output[lbl] = default if value is None else value
+        for lbl, action, field, value in separate:
+            act_qset = qset.filter(**value)
+            if action == "count":
+                output[lbl] = act_qset.count()
+            elif action == "sum":
+                output[lbl] = rest_helpers.getSum(act_qset, field)
+            elif action == "avg":
+                output[lbl] = rest_helpers.getAverage(act_qset, field)
+            elif action == "max":
+                output[lbl] = rest_helpers.getMax(act_qset, field)
+        return output
+
+    @classmethod
+    def _isManyLookup(cls, lookups):
+        # true if any of the filter lookups crosses a to-many relation
+        for key in lookups:
+            model = cls
+            for part in key.split("__"):
+                try:
+                    field = model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    break
+                if not field.is_relation:
+                    break
+                if field.many_to_many or field.one_to_many:
+                    return True
+                model = field.related_model
+                if model is None:
+                    break
+        return False
 
     @classmethod
     def on_rest_batch(cls, request, action):
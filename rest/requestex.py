@@ -33,6 +33,8 @@ class RequestData(object):
             request.DATA.parse()
 
     def __init__(self, request=None, data=None):
+        # id(dict) -> [dict, size, {lowercase key: key}] for case insensitive lookups
+        self._key_index = {}
         self.__data = data
         self.is_logged = False
         self.request = request
@@ -177,9 +179,50 @@ class RequestData(object):
         if data:
             value = data[pk]
             del data[pk]
+            entry = self._key_index.get(id(data))
+            if entry is not None and entry[0] is data:
+                entry[1] = len(data)
+                if isinstance(pk, str) and entry[2].get(pk.lower()) == pk:
+                    del entry[2][pk.lower()]
+                    # another key may differ only in case
+                    for k in data:
+                        if isinstance(k, str) and k.lower() == pk.lower():
+                            entry[2][pk.lower()] = k
+                            break
             return value
         return default
 
+    def buildKeyIndex(self, data):
+        # lowercase -> actual key (first match wins)
+        index = {}
+        for k in data:
+            if isinstance(k, str):
+                index.setdefault(k.lower(), k)
+        entry = [data, len(data), index]
+        self._key_index[id(data)] = entry
+        return entry
+
+    def getKeyIndex(self, data):
+        # kept in sync by set/remove, rebuilt only if the dict changed size
+        entry = self._key_index.get(id(data))
+        if entry is None or entry[0] is not data or entry[1] != len(data):
+            entry = self.buildKeyIndex(data)
+        return entry[2]
+
+    def findKey(self, key, data):
+        """
+        returns the actual key in data matching key case insensitively or None
+        dicts from toDict() should be changed with set/remove, a key swapped in
+        directly without changing the size is not seen until the size changes
+        """
+        if not isinstance(data, dict) or not isinstance(key, str):
+            return None
+        k = self.getKeyIndex(data).get(key.lower())
+        if k is not None and k not in data:
+            # stale hit, the key was removed behind our back
+            k = self.buildKeyIndex(data)[2].get(key.lower())
+        return k
+
     def getDictAndKey(self, key, data=None):
         """
         This will return the dict that holds the key.
@@ -198,16 +241,16 @@ class RequestData(object):
                 if not data:
                     return None, None
 
-                obj, pk = self.getDataAndKey(k, data)
+                obj, pk = self.getDictAndKey(k, data)
                 if obj is None:
                     return None, None
 
-                data = obj.get(key)
+                data = obj.get(pk)
             return obj, pk
 
-        for k in data:
-            if type(k) in [str, str] and k.lower() == key.lower():
-                return data, k
+        k = self.findKey(key, data)
+        if k is not None:
+            return data, k
         return None, None
 
     def getIgnore(self, key, data=None):
@@ -215,9 +258,9 @@ class RequestData(object):
             data = self.__data
 
         if data:
-            for k in data:
-                if type(k) in [str, str] and k.lower() == key.lower():
-                    return data.get(k)
+            k = self.findKey(key, data)
+            if k is not None:
+                return data.get(k)
         return NOTFOUND
 
     def getNormal(self, key, data=None):
@@ -402,14 +445,22 @@ class RequestData(object):
         for k in keys:
             depth -= 1
             if depth > 0:
-                res = self.get(k, data=data)
-                if res is None:
-                    data[k] = {}
+                res = self.getIgnore(k, data=data)
+                if res is None or res is NOTFOUND:
+                    self.setKey(data, k, {})
                     data = data[k]
                 else:
                     data = res
             else:
-                data[k] = value
+                self.setKey(data, k, value)
+
+    def setKey(self, data, key, value):
+        is_new = key not in data
+        data[key] = value
+        entry = self._key_index.get(id(data))
+        if is_new and entry is not None and entry[0] is data:
+            entry[1] = len(data)
+            entry[2].setdefault(key.lower(), key)
 
     def removeNonASCII(self, value):
         return "".join([x for x in value if x in SAFE_ASCII])
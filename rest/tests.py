@@ -0,0 +1,292 @@
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import URLResolver, Resolver404, re_path, include
+from django.urls.resolvers import RoutePattern
+from django.db import models
+from unittest import mock, skipUnless
+import base64
+import datetime
+import decimal
+import os
+import subprocess
+import sys
+
+from rest import views
+from rest import helpers
+from rest.decorators import RouteResolver
+from rest.requestex import RequestData
+from account.models import User, Member
+from medialib.models import MediaLibrary, MediaItem, MediaItemRendition
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class MediaTestCase(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username="rest_test")
+        self.library = MediaLibrary.objects.create(name="rest test", owner=owner)
+
+    def addItems(self, count, renditions=0):
+        # bulk_create skips MediaItem.save, which would start rendering
+        MediaItem.objects.bulk_create([MediaItem(library=self.library, name="item{}".format(i % 4), kind="I", state=200) for i in range(count)])
+        items = list(MediaItem.objects.filter(library=self.library).order_by("pk"))
+        MediaItemRendition.objects.bulk_create([
+            MediaItemRendition(mediaitem=item, name="r{}".format(j), use="image", kind="I", url="u{}".format(j), bytes=10 * (j + 1), width=100 * (j + 1))
+            for item in items for j in range(renditions)])
+        return items
+
+
+class SummaryTest(MediaTestCase):
+    def test_summary_across_relations(self):
+        # 3 items with 2 renditions each (10 and 20 bytes, 100 and 200 wide)
+        self.addItems(3, renditions=2)
+        summary = {
+            "sum": ["state", "renditions__bytes"],
+            "max": ["renditions__width"],
+            "wide|count": {"state": 200},
+            "wide_bytes|sum|renditions__bytes": {"renditions__width__gt": 100},
+        }
+        with mock.patch.object(MediaItem.RestMeta, "SUMMARY_FIELDS", summary, create=True):
+            output = MediaItem.getListSummary(MediaItem.objects.all())
+        self.assertEqual(output["count"], 3)
+        # the to-many join must not repeat the items for the other aggregates
+        self.assertEqual(output["state"], 600)
+        self.assertEqual(output["wide"], 3)
+        self.assertEqual(output["renditions__bytes"], 90)
+        self.assertEqual(output["max_renditions__width"], 200)
+        self.assertEqual(output["wide_bytes"], 60)
+
+
+@skipUnless(fakeredis, "needs fakeredis")
+class CachedResultTest(TestCase):
+    def test_hit_matches_miss(self):
+        redis = fakeredis.FakeStrictRedis()
+        func = mock.Mock(return_value={"count": 3, "total": decimal.Decimal("10.50"), "day": datetime.date(2026, 3, 8)})
+        with mock.patch("ws4redis.redis.getRedisClient", return_value=redis):
+            miss = helpers.getCachedResult("restcache:test", 60, func)
+            hit = helpers.getCachedResult("restcache:test", 60, func)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(miss, hit)
+        self.assertEqual([type(v) for v in miss.values()], [type(v) for v in hit.values()])
+
+
+class CursorPagingTest(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addItems(10)
+
+    def getPage(self, sort, page=None):
+        params = {"sort": sort, "size": 3}
+        if page:
+            params["page"] = page
+        request = RequestFactory().get("/", params)
+        request.member = None
+        RequestData.upgradeRequest(request)
+        return views.restList(request, MediaItem.objects.all(), fields=["id", "name"], cursor=True, accept_list=["data"])
+
+    def assertRoundTrip(self, sort):
+        expected = list(MediaItem.objects.order_by(sort, "pk").values_list("id", flat=True))
+        pages = [self.getPage(sort)]
+        while pages[-1].get("page_next"):
+            # a bad seek repeats pages forever
+            self.assertLessEqual(len(pages), len(expected))
+            pages.append(self.getPage(sort, pages[-1]["page_next"]))
+        self.assertEqual([row["id"] for page in pages for row in page["data"]], expected)
+        # walking back gives the same pages
+        for i in range(len(pages) - 1, 0, -1):
+            prev = self.getPage(sort, pages[i]["page_prev"])
+            self.assertEqual(prev["data"], pages[i - 1]["data"])
+
+    def test_unique_sort(self):
+        self.assertRoundTrip("-id")
+
+    def test_sort_with_ties(self):
+        # names repeat, pk breaks the ties
+        self.assertRoundTrip("name")
+        self.assertRoundTrip("-name")
+
+    @override_settings(USE_TZ=True, TIME_ZONE="America/New_York")
+    def test_datetime_sort(self):
+        # spans the DST change, 2026-03-08 07:00 UTC
+        start = datetime.datetime(2026, 3, 8, 5, 0, tzinfo=datetime.timezone.utc)
+        for i, pk in enumerate(MediaItem.objects.order_by("pk").values_list("pk", flat=True)):
+            MediaItem.objects.filter(pk=pk).update(created=start + datetime.timedelta(minutes=37 * i, microseconds=i))
+        self.assertRoundTrip("-created")
+        self.assertRoundTrip("created")
+
+    def test_invalid_token(self):
+        first = self.getPage("-id")
+        for token in ["[1, 2]", "5", "null"]:
+            page = self.getPage("-id", base64.b64encode(token.encode("utf-8")).decode("utf-8"))
+            self.assertEqual(page["data"], first["data"])
+            self.assertNotIn("page_prev", page)
+
+    def test_nullable_sort_uses_offset(self):
+        page = self.getPage("render_error")
+        self.assertEqual(page["count"], 10)
+        self.assertEqual(len(page["data"]), 3)
+
+
+class RequestDataKeyTest(TestCase):
+    def test_ignore_case(self):
+        data = RequestData(data={"Name": "a", "Nested": {"Inner": 1}})
+        self.assertEqual(data.get("name"), "a")
+        self.assertEqual(data.get("NESTED.inner"), 1)
+        data.set("newKey", 2)
+        self.assertEqual(data.get("NEWKEY"), 2)
+        self.assertEqual(data.remove("NAME"), "a")
+        self.assertIsNone(data.get("name"))
+        data.set("name", "b")
+        self.assertEqual(data.get("Name"), "b")
+
+    def test_remove_keeps_other_case(self):
+        data = RequestData(data={"Key": 1, "key": 2})
+        self.assertEqual(data.get("KEY"), 1)
+        data.remove("Key")
+        self.assertEqual(data.get("KEY"), 2)
+
+    def test_misses_do_not_rebuild(self):
+        data = RequestData(data={"Param{}".format(i): i for i in range(200)})
+        build = RequestData.buildKeyIndex
+        with mock.patch.object(RequestData, "buildKeyIndex", autospec=True, side_effect=build) as rebuilds:
+            for i in range(50):
+                self.assertIsNone(data.get("missing{}".format(i)))
+            self.assertEqual(data.get("param7"), 7)
+            self.assertEqual(rebuilds.call_count, 1)
+            # changing the size through toDict() is picked up
+            data.toDict()["Extra"] = 1
+            self.assertEqual(data.get("extra"), 1)
+            self.assertEqual(rebuilds.call_count, 2)
+
+
+@skipUnless(fakeredis, "needs fakeredis")
+@override_settings(PERMISSION_CACHE_TTL=60)
+class PermissionCacheTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        patcher = mock.patch("ws4redis.redis.getRedisClient", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.member = Member.objects.create(username="perm_test", email="perm_test@example.com")
+
+    def hasPerm(self, perm):
+        # a fresh instance reads through the shared cache
+        return Member.objects.get(pk=self.member.pk).hasPerm(perm)
+
+    def test_revoke_after_version_expired(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.addPermission("manage_media")
+        self.assertTrue(self.hasPerm("manage_media"))
+        # the version stamp expires while the cached set is still alive
+        self.redis.delete(self.member._permissionCacheKey() + ":version")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.removePermission("manage_media")
+        self.assertFalse(self.hasPerm("manage_media"))
+
+    def test_version_moves_after_commit(self):
+        self.assertFalse(self.hasPerm("manage_media"))
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.member.addPermission("manage_media")
+            # not committed yet, other processes still see the old set
+            self.assertFalse(self.hasPerm("manage_media"))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.hasPerm("manage_media"))
+
+
+class JSONEncoderTest(TestCase):
+    # picks the encoder at import, so each case runs in a fresh interpreter without orjson and ujson
+    SCRIPT = """
+import sys
+sys.modules["orjson"] = sys.modules["ujson"] = None
+from django.conf import settings
+if {encoder!r}:
+    settings.REST_JSON_ENCODER = {encoder!r}
+from rest import helpers
+helpers.log_print = lambda *args: print(*args)
+import django
+django.setup()
+from rest import views
+print(views.toJSONBytes({{"a": 1}}).decode())
+"""
+
+    def runEncoder(self, encoder):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        result = subprocess.run([sys.executable, "-c", self.SCRIPT.format(encoder=encoder)], env=env, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_warns_on_fallback(self):
+        output = self.runEncoder(None)
+        self.assertIn("recommend installing orjson!", output)
+        self.assertIn('{"a": 1}', output)
+
+    def test_explicit_json_is_quiet(self):
+        output = self.runEncoder("json")
+        self.assertNotIn("recommend installing orjson!", output)
+        self.assertIn('{"a": 1}', output)
+
+
+@skipUnless(pyarrow, "needs pyarrow")
+class ArrowTypeTest(TestCase):
+    def test_wide_decimals(self):
+        value = decimal.Decimal("1" * 45 + ".25")
+        for digits, kind in [(10, pyarrow.decimal128(10, 2)), (50, pyarrow.decimal256(50, 2)), (100, pyarrow.string())]:
+            ftype = views._arrowType(models.DecimalField(max_digits=digits, decimal_places=2))
+            self.assertEqual(ftype, kind)
+            if digits > 45:
+                schema = pyarrow.schema([("amount", ftype)])
+                batch = views._arrowBatch(schema, [(value,), (None,)])
+                self.assertEqual(decimal.Decimal(batch.column(0)[0].as_py()), value)
+
+
+def routeView(request, **kwargs):
+    return None
+
+
+def routeOther(request, **kwargs):
+    return None
+
+
+class RouteResolverTest(TestCase):
+    urlpatterns = [
+        re_path(r'^item$', routeView),
+        re_path(r'^item/(?P<pk>\d+)$', routeOther),
+        re_path(r'^(?P<kind>\w+)/list$', routeView),
+        re_path(r'^item/(?P<pk>\d+)/.*$', routeView),
+        re_path(r'^items?$', routeOther),
+        re_path(r'^nested/', include([
+            re_path(r'^leaf/(?P<pk>\d+)$', routeOther),
+        ])),
+    ]
+    paths = [
+        "rpc/item", "rpc/item/5", "rpc/item/5/extra", "rpc/items", "rpc/item/list",
+        "rpc/other/list", "rpc/nested/leaf/7", "rpc/nested/leaf/x", "rpc/missing", "other/item",
+    ]
+
+    def resolve(self, resolver, path):
+        try:
+            match = resolver.resolve(path)
+        except Resolver404:
+            return None
+        return (match.func, match.args, match.kwargs, match.route)
+
+    def test_matches_urlresolver(self):
+        django = URLResolver(RoutePattern("rpc/", is_endpoint=False), self.urlpatterns)
+        routed = RouteResolver(RoutePattern("rpc/", is_endpoint=False), self.urlpatterns)
+        for path in self.paths:
+            self.assertEqual(self.resolve(routed, path), self.resolve(django, path), path)
+
+    def test_new_patterns(self):
+        urlpatterns = list(self.urlpatterns)
+        routed = RouteResolver(RoutePattern("rpc/", is_endpoint=False), urlpatterns)
+        self.assertIsNone(self.resolve(routed, "rpc/added"))
+        urlpatterns.append(re_path(r'^added$', routeOther))
+        self.assertEqual(self.resolve(routed, "rpc/added")[0], routeOther)
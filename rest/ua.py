@@ -17,7 +17,12 @@
 from __future__ import absolute_import
 
 import re
+import functools
 from objict import objict
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
 
 
 __author__ = "Lindsey Simon <elsigh@gmail.com>"
@@ -27,7 +32,78 @@ def parse(user_agent):
     return objict.fromdict(Parse(user_agent))
 
 
-class UserAgentParser(object):
+def RequiredToken(pattern, flags=0):
+    """Longest literal every match of pattern must contain, used to skip regexes cheaply.
+
+    Returns (token, ignore_case), token is None if nothing is required.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None, False
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    tokens = []
+    run = []
+
+    def flush():
+        if run:
+            tokens.append("".join(run))
+            del run[:]
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+            flush()
+            if op is sre_parse.SUBPATTERN:
+                # skip groups with scoped flags, ie (?i:...)
+                if not av[1] and not av[2]:
+                    walk(av[3])
+                    flush()
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                walk(av[2])
+                flush()
+
+    walk(parsed)
+    flush()
+    if not tokens:
+        return None, ignore_case
+    token = max(tokens, key=len)
+    return (token.lower() if ignore_case else token), ignore_case
+
+
+class RegexParser(object):
+    """Compiles its pattern on first use instead of at import."""
+
+    regex_flags = 0
+    _user_agent_re = None
+
+    @property
+    def user_agent_re(self):
+        if self._user_agent_re is None:
+            self._user_agent_re = re.compile(self.pattern, self.regex_flags)
+        return self._user_agent_re
+
+
+_candidate_index = {}
+
+
+def Candidates(parsers, user_agent_string):
+    """Parsers (in order) whose required literal is in the string, the rest cannot match."""
+    index = _candidate_index.get(id(parsers))
+    if index is None:
+        index = [RequiredToken(p.pattern, p.regex_flags) + (p,) for p in parsers]
+        _candidate_index[id(parsers)] = index
+    # unicode case folding can match non ascii, only filter ascii strings when ignoring case
+    lowered = user_agent_string.lower() if user_agent_string.isascii() else None
+    return [
+        parser for token, ignore_case, parser in index
+        if token is None or (
+            (lowered is None or token in lowered) if ignore_case else token in user_agent_string)]
+
+
+class UserAgentParser(RegexParser):
     def __init__(
         self, pattern, family_replacement=None, v1_replacement=None, v2_replacement=None
     ):
@@ -40,7 +116,6 @@ class UserAgentParser(object):
           v2_replacement: a string to override the matched v2 (optional)
         """
         self.pattern = pattern
-        self.user_agent_re = re.compile(self.pattern)
         self.family_replacement = family_replacement
         self.v1_replacement = v1_replacement
         self.v2_replacement = v2_replacement
@@ -82,7 +157,7 @@ class UserAgentParser(object):
         return family, v1, v2, v3
 
 
-class OSParser(object):
+class OSParser(RegexParser):
     def __init__(
         self,
         pattern,
@@ -103,7 +178,6 @@ class OSParser(object):
           os_v4_replacement: a string to override the matched v4 (optional)
         """
         self.pattern = pattern
-        self.user_agent_re = re.compile(self.pattern)
         self.os_replacement = os_replacement
         self.os_v1_replacement = os_v1_replacement
         self.os_v2_replacement = os_v2_replacement
@@ -166,7 +240,7 @@ def MultiReplace(string, match):
     return _string
 
 
-class DeviceParser(object):
+class DeviceParser(RegexParser):
     def __init__(
         self,
         pattern,
@@ -183,9 +257,7 @@ class DeviceParser(object):
         """
         self.pattern = pattern
         if regex_flag == "i":
-            self.user_agent_re = re.compile(self.pattern, re.IGNORECASE)
-        else:
-            self.user_agent_re = re.compile(self.pattern)
+            self.regex_flags = re.IGNORECASE
         self.device_replacement = device_replacement
         self.brand_replacement = brand_replacement
         self.model_replacement = model_replacement
@@ -219,8 +291,7 @@ class DeviceParser(object):
         return device, brand, model
 
 
-MAX_CACHE_SIZE = 20
-_parse_cache = {}
+MAX_CACHE_SIZE = 512
 
 
 def Parse(user_agent_string, **jsParseBits):
@@ -231,21 +302,19 @@ def Parse(user_agent_string, **jsParseBits):
     Returns:
       A dictionary containing all parsed bits
     """
-    jsParseBits = jsParseBits or {}
-    key = (user_agent_string, repr(jsParseBits))
-    cached = _parse_cache.get(key)
-    if cached is not None:
-        return cached
-    if len(_parse_cache) > MAX_CACHE_SIZE:
-        _parse_cache.clear()
-    v = {
+    return _CachedParse(user_agent_string, tuple(sorted(jsParseBits.items())))
+
+
+@functools.lru_cache(maxsize=MAX_CACHE_SIZE)
+def _CachedParse(user_agent_string, jsParseBits):
+    # least recently used cache of results by ua string
+    jsParseBits = dict(jsParseBits)
+    return {
         "user_agent": ParseUserAgent(user_agent_string, **jsParseBits),
         "os": ParseOS(user_agent_string, **jsParseBits),
-        "device": ParseDevice(user_agent_string, **jsParseBits),
+        "device": ParseDevice(user_agent_string),
         "string": user_agent_string,
     }
-    _parse_cache[key] = v
-    return v
 
 
 def ParseUserAgent(user_agent_string, **jsParseBits):
@@ -265,7 +334,8 @@ def ParseUserAgent(user_agent_string, **jsParseBits):
         v2 = jsParseBits.get("js_user_agent_v2") or None
         v3 = jsParseBits.get("js_user_agent_v3") or None
     else:
-        for uaParser in USER_AGENT_PARSERS:
+        family, v1, v2, v3 = None, None, None, None
+        for uaParser in Candidates(USER_AGENT_PARSERS, user_agent_string):
             family, v1, v2, v3 = uaParser.Parse(user_agent_string)
             if family:
                 break
@@ -302,7 +372,8 @@ def ParseOS(user_agent_string, **jsParseBits):
     Returns:
       A dictionary containing parsed bits.
     """
-    for osParser in OS_PARSERS:
+    os, os_v1, os_v2, os_v3, os_v4 = None, None, None, None, None
+    for osParser in Candidates(OS_PARSERS, user_agent_string):
         os, os_v1, os_v2, os_v3, os_v4 = osParser.Parse(user_agent_string)
         if os:
             break
@@ -324,7 +395,8 @@ def ParseDevice(user_agent_string):
     Returns:
         A dictionary containing parsed bits.
     """
-    for deviceParser in DEVICE_PARSERS:
+    device, brand, model = None, None, None
+    for deviceParser in Candidates(DEVICE_PARSERS, user_agent_string):
         device, brand, model = deviceParser.Parse(user_agent_string)
         if device:
             break
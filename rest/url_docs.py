@@ -21,7 +21,7 @@ def guess_wrapper(cells):
         score = 0
         if contents.__name__ != '<lambda>':
             score += 1
-        if 'request' in inspect.getargspec(contents).args:
+        if 'request' in inspect.getfullargspec(contents).args:
             score += 1
 
         functions[score].append(contents)
@@ -56,7 +56,7 @@ def unwrap_and_compare(kwargs_provided, callback, description):
 
 
 def compare(kwargs_provided, callback, description):
-    spec = inspect.getargspec(callback)
+    spec = inspect.getfullargspec(callback)
 
     args = spec.args
     defaults = spec.defaults
@@ -1,11 +1,13 @@
 # from django.conf.urls import *
 from django.conf import settings
-from django.urls import path, include, re_path
+from django.urls import re_path
+from django.urls.resolvers import RoutePattern
 import pkgutil
 import importlib
 import sys
 import traceback
 from . import views
+from .decorators import RouteResolver
 
 
 def loadModule(mod):
@@ -46,7 +48,8 @@ def load_app(app, root_module=None):
         prefix = getattr(module, 'URL_PREFIX', app.split('.')[-1])
         if len(prefix) > 1:
             prefix += "/"
-        urls = path(prefix, include(root_module))
+        # same as path(prefix, include(root_module)) but matches by first path segment
+        urls = RouteResolver(RoutePattern(prefix, is_endpoint=False), root_module)
         urlpatterns.append(urls)
     return module
 
@@ -7,10 +7,11 @@ from django.conf import settings
 from version import VERSION
 
 from django.db import models
-from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import render
 from django.db import connection
-from django.db.models.query import QuerySet
+from django.db.models.query import QuerySet, ModelIterable
+from django.db.models.query_utils import DeferredAttribute
 from django.utils.datastructures import MultiValueDict
 # from account.models import User
 from django.core.exceptions import FieldDoesNotExist
@@ -30,31 +31,78 @@ import time
 import pprint
 import re
 import inspect
+import functools
 import base64
 import copy
 import json
+import tempfile
+import zlib
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except Exception:
+    pyarrow = None
 
-CHUNKDIR = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'chunked_uploads')
+try:
+    import zstandard
+except Exception:
+    zstandard = None
 
 
-def toJSON(data, **kwargs):
-    return json.dumps(data, cls=JSONEncoderExt)
-    # return json.dumps(data, **kwargs)
+CHUNKDIR = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'chunked_uploads')
 
-def prettyJSON(data):
-    return json.dumps(data, cls=JSONEncoderExt, sort_keys=True, indent=4, separators=(',', ': '))
+
+try:
+    import orjson
+except Exception:
+    orjson = None
 
 try:
     import ujson
+except Exception:
+    ujson = None
+
+# encoder for responses: "orjson", "ujson" or "json", defaults to the fastest installed
+REST_JSON_ENCODER = getattr(settings, "REST_JSON_ENCODER", "orjson" if orjson else ("ujson" if ujson else "json"))
+# orjson encodes datetimes, dates and Decimals itself so graphs can skip rest_serialize
+NATIVE_JSON = REST_JSON_ENCODER == "orjson" and orjson is not None
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+if NATIVE_JSON:
+    def toJSONBytes(data):
+        try:
+            return orjson.dumps(data, default=_orjsonDefault, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # ie ints over 64 bits
+            return json.dumps(data, cls=JSONEncoderExt).encode("utf-8")
+
+    def toJSON(data, **kwargs):
+        return toJSONBytes(data).decode("utf-8")
+elif REST_JSON_ENCODER == "ujson" and ujson is not None:
     def toJSON(data, **kwargs):
         # helpers.log_print(data)
         return ujson.dumps(data)
 
-    # def prettyJSON(data):
-    #   return json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
-except Exception:
-    helpers.log_print("recommend installing ujson!")
+    def toJSONBytes(data):
+        return toJSON(data).encode("utf-8")
+else:
+    # an explicit "json" is a choice, anything else fell back for lack of orjson
+    if REST_JSON_ENCODER != "json" or not hasattr(settings, "REST_JSON_ENCODER"):
+        helpers.log_print("recommend installing orjson!")
+
+    def toJSON(data, **kwargs):
+        return json.dumps(data, cls=JSONEncoderExt)
+        # return json.dumps(data, **kwargs)
+
+    def toJSONBytes(data):
+        return toJSON(data).encode("utf-8")
+
+def prettyJSON(data):
+    return json.dumps(data, cls=JSONEncoderExt, sort_keys=True, indent=4, separators=(',', ': '))
 
 # is this useless??? we have rest_serialize
 class JSONEncoderExt(json.JSONEncoder):
@@ -80,6 +128,16 @@ class JSONEncoderExt(json.JSONEncoder):
         return "not parsable"
 
 
+def _orjsonDefault(obj):
+    # datetimes, dates and Decimals come out as rest_serialize would write them
+    if isinstance(obj, Decimal) and not obj.is_finite():
+        # float() would give inf/nan which orjson writes as null
+        return 0.0
+    return _JSON_EXT.default(obj)
+
+_JSON_EXT = JSONEncoderExt()
+
+
 class RawQuery(object):
     def __init__(self, model, distinct=False, returns=None, joins=None, where=None, groupby=None, having=None, sort=None, limit=None, offset=None, count_by=None, last_sort=None, uniques=[]):
         self.model = model
@@ -249,11 +307,10 @@ def _getFields(qset=None, model=None):
     return None
 
 
-def _returnResults(request, ret, accept_list=None, status=200):
+def _getAcceptList(request, accept_list=None):
     """
-    returns a response data object in json, text or html
+    returns the response types asked for, without parameters
     """
-    # figure return type
     if not accept_list:
         if request and request.DATA.get('_type', None):
             accept_list = [request.DATA.get('_type')]
@@ -268,6 +325,14 @@ def _returnResults(request, ret, accept_list=None, status=200):
         a2 = accept_list[i].split(";", 1)
         if len(a2) == 2:
             accept_list[i] = a2[0]
+    return accept_list
+
+def _returnResults(request, ret, accept_list=None, status=200):
+    """
+    returns a response data object in json, text or html
+    """
+    # figure return type
+    accept_list = _getAcceptList(request, accept_list)
 
     if "data" not in accept_list:
         ret["datetime"] = time.time()
@@ -289,7 +354,7 @@ def _returnResults(request, ret, accept_list=None, status=200):
         if callback:
             return HttpResponse("%s(%s)" % (callback, toJSON(ret)), content_type="application/json", status=status)
         try:
-            return HttpResponse(toJSON(ret), content_type="application/json", status=status)
+            return HttpResponse(toJSONBytes(ret), content_type="application/json", status=status)
         except Exception as err:
             helpers.log_print(ret)
             raise err
@@ -333,7 +398,7 @@ def _returnResults(request, ret, accept_list=None, status=200):
     elif 'data' in accept_list:
         return ret
     else:
-        return HttpResponse(toJSON(ret), content_type="text/plain", status=status)
+        return HttpResponse(toJSONBytes(ret), content_type="text/plain", status=status)
 
 def _filter_recurse(remove, lst):
     if isinstance(lst, dict):
@@ -354,13 +419,54 @@ def _filter_recurse(remove, lst):
 
     return ret
 
+def _prefetchFor(model, lookup):
+    """
+    returns a Prefetch for the lookup that keeps the same ordering
+    restListEx would have applied to the related set
+    """
+    for name in lookup.split("__"):
+        field = None
+        for f in model._meta.get_fields():
+            # reverse relations are prefetched by their accessor name
+            if f.name == name or (f.auto_created and not f.concrete and f.get_accessor_name() == name):
+                field = f
+                break
+        if field is None or field.related_model is None:
+            return lookup
+        model = field.related_model
+    ordering = list(model._meta.ordering or [])
+    ordering.append("pk")
+    return models.Prefetch(lookup, queryset=model._default_manager.order_by(*ordering))
+
+def _applyQueryPlan(qset, select_related=None, prefetch_related=None):
+    """
+    applies the graph query plan (see RestModel.buildQueryPlan) to a QuerySet
+    """
+    if type(qset) != QuerySet or qset._result_cache is not None:
+        return qset
+    if select_related:
+        qset = qset.select_related(*select_related)
+    if prefetch_related:
+        qset = qset.prefetch_related(*[_prefetchFor(qset.model, lookup) for lookup in prefetch_related])
+    return qset
+
 def restReturn(request, data, accept_list=None):
     return _returnResults(request, data, accept_list)
 
+@functools.lru_cache(maxsize=4096)
+def _acceptedArgs(func):
+    # named arguments a graph callable accepts, computed once per function
+    try:
+        params = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return frozenset()
+    return frozenset(p.name for p in params if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY))
+
 def __call_func(func, *args, **kwargs):
     if not kwargs:
         return func(*args)
-    take = inspect.getargspec(func)[0]
+    # bound methods are new objects on every access, cache on the underlying function
+    take = _acceptedArgs(getattr(func, "__func__", func))
     give = {}
     for arg in kwargs:
         if arg in take:
@@ -473,7 +579,7 @@ def updateFeature(func, request, qset, featuresets={}, features=[], **kwargs):
     else:
         return None
 
-def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, orig_request=None, orig_objs={}, ignore_noattr=False, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True):
+def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, orig_request=None, orig_objs={}, ignore_noattr=False, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True, select_related=None, prefetch_related=None, serializer=None):
     """
     request: HttpRequest object
     qset: QuerySet or data object to return
@@ -486,6 +592,9 @@ def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_d
     filter: (optional) filters for recurse fetch (default all)
     ignore_noattr: (optional) ignore unknown attributes (default false)
     accept_list: (optional) requested return format
+    select_related: (optional) foreign keys to join in, see RestModel.buildQueryPlan
+    prefetch_related: (optional) related sets to prefetch, see RestModel.buildQueryPlan
+    serializer: (optional) compiled GraphSerializer for the graph
     RETURN: HttpResponse
 
     process a RESTful GET request to get an object.  User is responsible for checking permissions, etc before calling.
@@ -510,10 +619,16 @@ def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_d
         raise Http404
     if type(qset) == QuerySet:
         try:
-            qset = qset[0]
+            qset = _applyQueryPlan(qset, select_related, prefetch_related)[0]
         except IndexError:
             raise Http404
 
+    if serializer is not None and not fkey_depth and isinstance(qset, models.Model):
+        if _nativeResponse(request, return_httpresponse, accept_list):
+            serializer = serializer.asNative()
+        ret = serializer.serialize(request, qset, model=model, orig_request=orig_request, orig_objs=orig_objs)
+        return _restGetResults(request, ret, accept_list, return_httpresponse)
+
     if not fields or list(fields) == ["*"]:
         fields = _getFields(qset, model)
         #print fields
@@ -729,6 +844,9 @@ def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_d
                     continue
                 ret[x] = odata[x]
 
+    return _restGetResults(request, ret, accept_list, return_httpresponse)
+
+def _restGetResults(request, ret, accept_list=None, return_httpresponse=True):
     if return_httpresponse:
         if not (accept_list != None and 'data' in accept_list):
             ret = { 'status': True, 'data': ret }
@@ -736,6 +854,486 @@ def restGet(request, qset, model=None, fields=None, extra=[], exclude=[], fkey_d
 
     return ret
 
+# class bodies mangle __names, so GraphSerializer needs an alias
+_call_func = __call_func
+
+_SIMPLE_TYPES = (str, int, float, bool, type(None), datetime.datetime, datetime.date, Decimal)
+
+
+def _nativeValue(data):
+    # orjson writes NaN and +-Inf as null, keep the 0.0 rest_serialize gives
+    if type(data) is float and not math.isfinite(data):
+        return 0.0
+    if type(data) in _SIMPLE_TYPES:
+        return data
+    # lists and dicts from model methods can hold floats too
+    return rest_serialize(data)
+
+
+def _nativeResponse(request, return_httpresponse, accept_list):
+    # only a json response is encoded by toJSON alone, text/html, text/plain
+    # and DEBUG_REST_OUTPUT logging still need the rest_serialize pass
+    if not NATIVE_JSON or not return_httpresponse or getattr(settings, "DEBUG_REST_OUTPUT", False):
+        return False
+    accept_list = _getAcceptList(request, list(accept_list or []))
+    return "application/json" in accept_list and "data" not in accept_list
+
+# rows fetched per database round trip when streaming exports
+EXPORT_CHUNK_SIZE = getattr(settings, "REST_EXPORT_CHUNK_SIZE", 2000)
+
+FIELD_FUNC = 1
+FIELD_CHAIN = 2
+FIELD_ATTR = 3
+FIELD_VALUE = 4
+FIELD_FK = 5
+FIELD_FK_RECURSE = 6
+
+VALUES_COLUMN = 1
+VALUES_NULL = 2
+VALUES_NESTED = 3
+
+
+class GraphSerializer(object):
+    """
+    compiled version of restGet for a graph
+
+    the field spec (fields, extra, exclude, recurse_into, filter) is parsed once,
+    for each model class it is turned into a flat list of accessors that are then
+    run for every row, nested graphs get their own compiled sub serializers.
+    output is identical to restGet
+    """
+    def __init__(self, fields=None, extra=[], exclude=[], recurse_into=[], filter={}, ignore_noattr=False, native=False, **kwargs):
+        self.fields = fields
+        self.extra = extra
+        self.exclude = exclude
+        self.recurse_into = recurse_into
+        self.filter = filter
+        self.ignore_noattr = ignore_noattr
+        self.key_value = "key" in extra and "value" in extra and len(extra) == 2 and "*" in exclude
+        self._plans = {}
+        self._values_plans = {}
+        self._subs = {}
+        self._recurse = self._compileRecurse()
+        # native leaves datetimes, Decimals etc for the json encoder (see NATIVE_JSON)
+        self.native = native
+        self.convert = _nativeValue if native else rest_serialize
+        self._native = self if native else None
+
+    def asNative(self):
+        """
+        returns a twin sharing the compiled plans that skips rest_serialize,
+        only for output going straight to toJSON with NATIVE_JSON
+        """
+        if self._native is None:
+            twin = copy.copy(self)
+            twin.native = True
+            twin.convert = _nativeValue
+            twin._subs = {}
+            twin._native = twin
+            self._native = twin
+        return self._native
+
+    def getPlan(self, model):
+        plan = self._plans.get(model, None)
+        if plan is None:
+            plan = self._compileFields(model)
+            self._plans[model] = plan
+        return plan
+
+    def getSub(self, fname):
+        sub = self._subs.get(fname, None)
+        if sub is None:
+            fields = self.fields
+            if not fields or list(fields) == ["*"] or "*" in self.exclude:
+                fields = []
+            sub = GraphSerializer(
+                fields=_filter_recurse(fname, fields), extra=_filter_recurse(fname, self.extra),
+                exclude=_filter_recurse(fname, self.exclude), recurse_into=_filter_recurse(fname, self.recurse_into),
+                filter=_filter_recurse(fname, self.filter), native=self.native)
+            self._subs[fname] = sub
+        return sub
+
+    def _compileFields(self, model):
+        fields = self.fields
+        if not fields or list(fields) == ["*"]:
+            fields = _getFields(model=model)
+        if "*" in self.exclude:
+            fields = []
+        fields = list(fields)
+        for f in self.extra:
+            if f[:2] == "*.":
+                f = f[2:]
+            if "." in f:
+                continue
+            if f not in fields:
+                fields.append(f)
+
+        plan = []
+        for f in fields:
+            if type(f) in (list, tuple):
+                fout = f[1]
+                f = f[0]
+            else:
+                fout = f
+            fargs = []
+            if type(f) is str and "|" in f:
+                fargs = f.split("|")
+                f = fargs.pop(0)
+            if type(f) in (types.FunctionType, types.LambdaType):
+                plan.append((FIELD_FUNC, f, fout, fargs, False))
+                continue
+            if f in self.exclude or "*." + f in self.exclude:
+                continue
+            if f[0] == "!":
+                if fout[0] == "!":
+                    fout = fout[1:]
+                plan.append((FIELD_CHAIN, f[1:], fout, fargs, f[1:] in self.recurse_into))
+                continue
+            if "." in f:
+                continue
+            kind = FIELD_ATTR
+            try:
+                field = model._meta.get_field(f)
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and field.concrete:
+                if field.is_relation and (field.many_to_one or field.one_to_one) and f == field.name:
+                    # never load the related row just to output its id
+                    if f in self.recurse_into:
+                        kind = FIELD_FK_RECURSE
+                    else:
+                        kind = FIELD_FK
+                    plan.append((kind, field.attname, fout, fargs, False))
+                    continue
+                if not field.is_relation and f == field.attname:
+                    kind = FIELD_VALUE
+            plan.append((kind, f, fout, fargs, f in self.recurse_into))
+        return plan
+
+    def getValuesPlan(self, model):
+        """
+        returns (columns, steps) when the whole graph resolves to concrete columns
+        and forward foreign keys, so rows can be built from values_list tuples.
+        returns None when the graph needs model instances (properties, methods, sets)
+        """
+        plan = self._values_plans.get(model, None)
+        if plan is None:
+            columns = []
+            steps = self._compileValues(model, "", columns, getattr(getattr(model, "RestMeta", None), "DATABASE", None))
+            plan = False
+            if steps is not None:
+                plan = (columns, steps)
+            self._values_plans[model] = plan
+        if plan is False:
+            return None
+        return plan
+
+    def _compileValues(self, model, prefix, columns, db):
+        steps = []
+        for kind, f, fout, fargs, in_recurse in self.getPlan(model):
+            if kind == FIELD_VALUE:
+                # fields with their own descriptor (files, etc) differ from the raw column
+                if type(getattr(model, f, None)) is not DeferredAttribute:
+                    return None
+                columns.append(prefix + f)
+                steps.append((VALUES_COLUMN, len(columns) - 1, fout, None))
+            elif kind in (FIELD_FK, FIELD_FK_RECURSE):
+                columns.append(prefix + f)
+                if kind == FIELD_FK:
+                    steps.append((VALUES_COLUMN, len(columns) - 1, fout, None))
+                else:
+                    steps.append((VALUES_NULL, len(columns) - 1, fout, None))
+            else:
+                return None
+        for f, fout, fname in self._recurse:
+            if not fout or f.startswith("generic__"):
+                return None
+            try:
+                field = model._meta.get_field(f)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or not field.is_relation or f != field.name:
+                return None
+            if not (field.many_to_one or field.one_to_one):
+                return None
+            if getattr(getattr(field.related_model, "RestMeta", None), "DATABASE", None) != db:
+                return None
+            columns.append(prefix + field.attname)
+            fk_index = len(columns) - 1
+            sub = self.getSub(fname)._compileValues(field.related_model, prefix + f + "__", columns, db)
+            if sub is None:
+                return None
+            steps.append((VALUES_NESTED, fk_index, fout, sub))
+        return steps
+
+    def _buildValues(self, steps, row):
+        ret = {}
+        for kind, index, fout, sub in steps:
+            value = row[index]
+            if kind == VALUES_COLUMN:
+                if type(value) in _SIMPLE_TYPES:
+                    ret[fout] = self.convert(value)
+                else:
+                    ret[fout] = self._finishValue(value, fout, [], None, None, {})
+            elif kind == VALUES_NULL:
+                if value is None:
+                    ret[fout] = None
+            elif value is None:
+                ret[fout] = None
+            else:
+                odata = self._buildValues(sub, row)
+                if len(odata) == 0:
+                    odata = None
+                ret[fout] = odata
+        return ret
+
+    def serializeValues(self, request, qset):
+        """
+        serializes a QuerySet straight from values_list without building model instances,
+        returns None if the graph does not allow it
+        """
+        if type(qset) != QuerySet or qset._iterable_class is not ModelIterable:
+            return None
+        plan = self.getValuesPlan(qset.model)
+        if plan is None:
+            return None
+        if request and not hasattr(request, "rest_class") and hasattr(qset.model, "on_rest_request"):
+            request.rest_class = qset.model
+        columns, steps = plan
+        return [self._buildValues(steps, row) for row in qset.values_list(*columns)]
+
+    def iterate(self, request, qset, chunk_size=None):
+        """
+        generator of serialized rows that streams qset from the database in chunks,
+        from values_list when the graph allows it
+        """
+        if chunk_size is None:
+            chunk_size = EXPORT_CHUNK_SIZE
+        plan = None
+        if qset._iterable_class is ModelIterable:
+            plan = self.getValuesPlan(qset.model)
+        if plan is not None:
+            columns, steps = plan
+            for row in qset.values_list(*columns).iterator(chunk_size=chunk_size):
+                yield self._buildValues(steps, row)
+            return
+        for obj in qset.iterator(chunk_size=chunk_size):
+            yield self.serialize(request, obj)
+
+    def _compileRecurse(self):
+        recurse = []
+        recursed = []
+        for f in self.recurse_into:
+            if '.' in f:
+                continue
+            if type(f) in (list, tuple):
+                fout = f[1]
+                f = f[0]
+            else:
+                fout = f
+            fname = fout
+            if fname == "":
+                fname = f
+            if f[:2] == "*.":
+                f = f[2:]
+            if fname in recursed:
+                continue
+            recursed.append(fname)
+            recurse.append((f, fout, fname))
+        return recurse
+
+    def _finishValue(self, data, f, fargs, obj, orig_request, orig_objs):
+        if isinstance(data, dict) and hasattr(data, "asDict"):
+            data = data.asDict()
+        elif hasattr(data, '__func__'):
+            data = _call_func(data, *fargs, request=orig_request, obj__self=obj, **orig_objs)
+        elif type(f) is str and f.startswith("get_") and f.endswith("_display") and callable(data):
+            data = data()
+        return self.convert(data)
+
+    def serialize(self, request, obj, model=None, orig_request=None, orig_objs={}):
+        if not orig_request:
+            orig_request = request
+        if not model:
+            model = obj.__class__
+        if request and not hasattr(request, "rest_class") and hasattr(model, "on_rest_request"):
+            request.rest_class = model
+
+        objs = orig_objs.copy()
+        objs['obj__parent'] = obj
+        objs['obj_' + model.__name__] = obj
+
+        ret = {}
+        for kind, f, fout, fargs, in_recurse in self.getPlan(obj.__class__):
+            if kind == FIELD_VALUE:
+                data = getattr(obj, f)
+                if type(data) in _SIMPLE_TYPES:
+                    ret[fout] = self.convert(data)
+                    continue
+            elif kind == FIELD_FK:
+                ret[fout] = getattr(obj, f)
+                continue
+            elif kind == FIELD_FK_RECURSE:
+                if getattr(obj, f) is None:
+                    ret[fout] = None
+                continue
+            elif kind == FIELD_FUNC:
+                data = f(obj)
+            elif kind == FIELD_CHAIN:
+                data = obj
+                for s in f.split("."):
+                    data = getattr(data, s)
+                    if data == None:
+                        break
+                    if hasattr(data, '__func__'):
+                        data = _call_func(data, request=orig_request, obj__self=obj, **orig_objs)
+            else:
+                try:
+                    data = getattr(obj, f)
+                except AttributeError:
+                    try:
+                        data = obj[f]
+                    except (TypeError, KeyError, IndexError):
+                        if not self.ignore_noattr:
+                            helpers.log_print("{} has no attribute: {}".format(type(obj), f))
+                        continue
+
+            data = self._finishValue(data, f, fargs, obj, orig_request, orig_objs)
+            if isinstance(data, models.Model):
+                if in_recurse:
+                    pass
+                elif hasattr(obj, f + "_id"):
+                    ret[fout] = getattr(obj, f + "_id")
+                else:
+                    ret[fout] = data.pk
+            elif hasattr(data, 'all'):
+                pass
+            else:
+                ret[fout] = data
+
+        for f, fout, fname in self._recurse:
+            rset = None
+            odata = {}
+            if f.startswith("generic__") and hasattr(obj, "restGetGenericRelation"):
+                generic_graph = "generic"
+                if fout != f:
+                    generic_graph = fout
+                fout = f.split("__")[1]
+                try:
+                    gobj = obj.restGetGenericRelation(fout)
+                except Exception as err:
+                    helpers.log_print("generic relationship error")
+                    helpers.log_exception(err)
+                    gobj = None
+                if not gobj:
+                    continue
+                gser = gobj.getGraphSerializer(generic_graph)
+                if self.native:
+                    gser = gser.asNative()
+                odata = gser.serialize(request, gobj, orig_request=orig_request)
+                odata["model"] = getattr(obj, fout)
+                gkey = "{0}_id".format(fout)
+                if gkey in ret:
+                    del ret[gkey]
+            else:
+                try:
+                    value = getattr(obj, f)
+                    has_field = True
+                except AttributeError:
+                    value = None
+                    has_field = False
+                if has_field and (hasattr(value, 'all') or isinstance(value, list)):
+                    rset = value
+                    odata = []
+                elif hasattr(obj, f + '_set'):
+                    rset = getattr(obj, f + '_set')
+                    odata = []
+                elif has_field and isinstance(value, models.Model):
+                    odata = self.getSub(fname).serialize(request, value, orig_request=orig_request, orig_objs=objs)
+                elif has_field and callable(value):
+                    rset = value()
+                    if rset is not None:
+                        odata = []
+
+            if rset and isinstance(rset, models.Model):
+                odata = self.getSub(fname).serialize(request, rset, orig_request=orig_request, orig_objs=objs)
+                rset = None
+            if rset:
+                filt = self.filter.get(fname, None)
+                if isinstance(rset, list):
+                    pass
+                elif filt:
+                    rset = rset.filter(**filt)
+                elif hasattr(rset, "all"):
+                    rset = rset.all()
+
+                if type(rset) is list and len(rset) and not hasattr(rset[0], "id"):
+                    odata = rset
+                elif isinstance(rset, dict) or type(rset) in [float, int, str]:
+                    odata = rset
+                else:
+                    odata = self.getSub(fname).serializeList(request, rset, orig_request=orig_request, orig_objs=objs)
+
+            if fout:
+                if isinstance(odata, dict) and len(odata) == 0:
+                    odata = None
+                ret[fout] = odata
+            else:
+                if type(odata) == list:
+                    if len(odata[:1]) == 0:
+                        continue
+                    odata = odata[0]
+                for x in odata:
+                    # never allow overriding id for emptry recurse
+                    if x == "id":
+                        continue
+                    ret[x] = odata[x]
+        return ret
+
+    def serializeList(self, request, qset, orig_request=None, orig_objs={}):
+        """
+        compiled version of restListEx(None, qset, size=0, accept_list=['data'])
+        as used by restGet for related sets
+        """
+        if self.key_value or type(qset) == RawQuery:
+            return restListEx(
+                None, qset, size=0, fields=self.fields, extra=self.extra, exclude=self.exclude,
+                recurse_into=self.recurse_into, filter=self.filter, accept_list=['data'],
+                orig_request=orig_request, orig_objs=orig_objs)
+        if type(qset) == QuerySet and qset._result_cache is None and qset.query.can_filter():
+            qset = qset.order_by(*_pagingOrder(qset))
+        model = getattr(qset, "model", None)
+        data = []
+        if qset:
+            for qr in qset:
+                if type(qr) in [float, int, str, Decimal]:
+                    data.append(qr)
+                elif not isinstance(qr, models.Model):
+                    data.append(restGet(
+                        request, qr, model=model, fields=self.fields, extra=self.extra, exclude=self.exclude,
+                        recurse_into=self.recurse_into, filter=self.filter, accept_list=['data'],
+                        orig_request=orig_request, orig_objs=orig_objs))
+                else:
+                    data.append(self.serialize(request, qr, model=model, orig_request=orig_request, orig_objs=orig_objs))
+        return data
+
+
+def _pagingOrder(qset):
+    """
+    returns the ordering of a QuerySet with pk appended so paging is stable
+    """
+    if not qset.ordered:
+        modelorder = []
+    elif qset.query.extra_order_by:
+        modelorder = qset.query.extra_order_by
+    elif not qset.query.default_ordering:
+        modelorder = qset.query.order_by
+    else:
+        modelorder = qset.query.order_by or qset.query.model._meta.ordering or []
+    modelorder = list(modelorder)
+    modelorder.append('pk')
+    return modelorder
+
 def _order_list(ordering, data, dir, clear=False):
     ret = {"_dir": dir}
     if dir == '=':
@@ -748,8 +1346,13 @@ def _order_list(ordering, data, dir, clear=False):
             except AttributeError:
                 name = o.split(".")[-1]
             r = getattr(data, name)
-            if type(r) in (datetime.datetime, datetime.date):
-                r = {"datetime": [int(time.mktime(r.timetuple())), getattr(r, 'microsecond', 0)]}
+            if type(r) is datetime.datetime:
+                # aware values as UTC, local time would shift with TIME_ZONE and DST
+                if r.tzinfo is not None:
+                    r = r.astimezone(datetime.timezone.utc)
+                r = {"datetime": r.isoformat()}
+            elif type(r) is datetime.date:
+                r = {"date": r.isoformat()}
             ret[getattr(o, 'name', o)] = r
     ret = toJSON(ret);
     if not clear:
@@ -757,6 +1360,108 @@ def _order_list(ordering, data, dir, clear=False):
     return ret
 
 
+def _pageValue(value):
+    # decode a value encoded by _order_list
+    if isinstance(value, dict) and "datetime" in value:
+        if isinstance(value["datetime"], str):
+            return datetime.datetime.fromisoformat(value["datetime"])
+        # older tokens, local epoch and microseconds
+        data = datetime.datetime.fromtimestamp(value["datetime"][0])
+        return data.replace(microsecond=value["datetime"][1])
+    elif isinstance(value, dict) and "date" in value:
+        if isinstance(value["date"], str):
+            return datetime.date.fromisoformat(value["date"])
+        return datetime.date.fromtimestamp(value["date"][0])
+    return value
+
+
+def _cursorOrdering(qset):
+    """
+    returns [(field, rev)] for keyset paging, or None if the ordering can not be seeked
+    (expressions, lookups across relations, non concrete or nullable fields)
+    """
+    ordering = []
+    for o in _pagingOrder(qset):
+        if not isinstance(o, str):
+            return None
+        rev = o.startswith('-')
+        o = o.lstrip('-')
+        if "__" in o or "." in o:
+            return None
+        try:
+            field = qset.model._meta.pk if o == 'pk' else qset.model._meta.get_field(o)
+        except FieldDoesNotExist:
+            return None
+        if not getattr(field, "concrete", False) or field.null:
+            # where NULLs sort is database specific
+            return None
+        ordering.append((field, rev))
+        if field.unique:
+            return ordering
+    return ordering
+
+
+def updateCursorPagination(request, qset, size, page=None):
+    """
+    keyset pagination, the page token is turned into a WHERE on the sort key and pk
+    and size+1 rows are fetched in a single query (no OFFSET and no COUNT)
+    RETURN: (rows, ret) or (None, {}) if the ordering does not support cursors
+    """
+    ordering = _cursorOrdering(qset)
+    if not ordering:
+        helpers.log_print("cursor paging not supported, using offset paging for", qset.model.__name__, _pagingOrder(qset))
+        return None, {}
+    if request:
+        page = request.DATA.get('page', page)
+    page_data = None
+    if page:
+        try:
+            page_data = json.loads(base64.b64decode(page))
+        except Exception:
+            pass
+        if not isinstance(page_data, dict):
+            # start over at the first page
+            helpers.log_print("invalid page token", page)
+            page_data = None
+    if page_data is None:
+        page, page_data = None, {'_dir': '+'}
+    forward = page_data.get("_dir") != '-'
+
+    qset = qset.order_by(*["{}{}".format('-' if rev else '', field.name) for field, rev in ordering])
+    qfilter = None
+    prefix = {}
+    for field, rev in ordering:
+        if field.name not in page_data:
+            break
+        data = _pageValue(page_data[field.name])
+        op = "lt" if rev == forward else "gt"
+        q = Q(**prefix) & Q(**{"{}__{}".format(field.name, op): data})
+        qfilter = q if qfilter is None else qfilter | q
+        prefix[field.name] = data
+
+    if qfilter is not None:
+        qset = qset.filter(qfilter)
+    if not forward:
+        qset = qset.reverse()
+    rows = list(qset[:size+1])
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if not forward:
+        rows.reverse()
+
+    ret = {}
+    if rows:
+        if has_more or not forward:
+            ret['page_next'] = _order_list(ordering, rows[-1], '+')
+        if page and (forward or has_more):
+            ret['page_prev'] = _order_list(ordering, rows[0], '-')
+    return rows, ret
+
+
+def _todata(obj):
+    return obj
+
+
 def restListOther(request, qset, size=25, start=0, sort=None, accept_list=None, return_httpresponse=True):
 
     if request:
@@ -799,7 +1504,7 @@ def restListOther(request, qset, size=25, start=0, sort=None, accept_list=None,
     return _returnResults(request, ret, accept_list)
 
 
-def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, get_count=True, orig_request=None, orig_objs={}, page=None, ignore_noattr=False, todata=lambda x: x, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True, totals=None):
+def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, get_count=True, orig_request=None, orig_objs={}, page=None, ignore_noattr=False, todata=_todata, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True, totals=None, select_related=None, prefetch_related=None, serializer=None, cursor=False, count_estimate=False, count_cache=0):
     """
     request: HttpRequest object
     qset: QuerySet or data object to return
@@ -818,6 +1523,12 @@ def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None
     ignore_noattr: (optional) ignore unknown attributes (default false)
     todata: (optional) function to convert per-element data into data for restGet
     accept_list: (optional) requested return format
+    select_related: (optional) foreign keys to join in, see RestModel.buildQueryPlan
+    prefetch_related: (optional) related sets to prefetch, see RestModel.buildQueryPlan
+    serializer: (optional) compiled GraphSerializer for the graph, compiled per call if not given
+    cursor: (optional) keyset pagination by page token only, no OFFSET or COUNT, can override via GET[cursor]
+    count_estimate: (optional) use planner estimates for large counts, see helpers.getCount
+    count_cache: (optional) seconds to cache the count in redis by the queryset filters
     RETURN: HttpResponse
 
     process a RESTful GET request to list a set of objects.  User is responsible for checking permissions, etc before calling.
@@ -842,10 +1553,7 @@ def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None
         size = request.DATA.get(['size', '_size'], size, field_type=int)
         start = request.DATA.get(['start', '_start'], start, field_type=int)
         sort = request.DATA.get('sort', sort)
-
-    count = 0
-    if get_count:
-        count = qset.count()
+        cursor = request.DATA.get('cursor', cursor, field_type=bool)
 
     if sort and isinstance(sort, str):
         if "metadata" in sort:
@@ -867,16 +1575,42 @@ def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None
             except Exception:
                 helpers.log_exception("sorting error", sort_args)
 
-    qset, ret = updatePagination(request, qset, size, count, start, page)
-
-    qset = qset[:size]
+    count = None
+    rows = None
+    if cursor and size:
+        rows, ret = updateCursorPagination(request, _applyQueryPlan(qset, select_related, prefetch_related), size, page)
+    if rows is None:
+        count = 0
+        if get_count:
+            count = helpers.getCount(qset, count_estimate, count_cache)
+        qset, ret = updatePagination(request, qset, size, count, start, page)
+        qset = qset[:size]
+    else:
+        qset = rows
+
+    if fkey_depth or require_perms:
+        # restGet handles these per row
+        serializer = None
+    elif serializer is None:
+        serializer = GraphSerializer(fields=fields, extra=extra, exclude=exclude, recurse_into=recurse_into, filter=filter, ignore_noattr=ignore_noattr)
+    if serializer is not None and _nativeResponse(request, return_httpresponse, accept_list):
+        serializer = serializer.asNative()
     # print fields
-    data_list = []
-    for obj in qset:
-        if type(obj) in [list, tuple, QuerySet]:
-            data_list.append(restList(request, todata(obj), model=model, fields=fields, extra=extra, exclude=exclude, fkey_depth=fkey_depth, recurse_into=recurse_into, filter=filter, ignore_noattr=ignore_noattr, accept_list=['data'], orig_request=orig_request, orig_objs=orig_objs, return_httpresponse=False))
-        else:
-            data_list.append(restGet(request, todata(obj), model=model, fields=fields, extra=extra, exclude=exclude, fkey_depth=fkey_depth, recurse_into=recurse_into, filter=filter, ignore_noattr=ignore_noattr, accept_list=['data'], orig_request=orig_request, orig_objs=orig_objs))
+    data_list = None
+    if serializer is not None and todata is _todata:
+        # graphs of plain columns are built without model instances
+        data_list = serializer.serializeValues(request, qset)
+    if data_list is None:
+        data_list = []
+        for obj in _applyQueryPlan(qset, select_related, prefetch_related):
+            if type(obj) in [list, tuple, QuerySet]:
+                data_list.append(restList(request, todata(obj), model=model, fields=fields, extra=extra, exclude=exclude, fkey_depth=fkey_depth, recurse_into=recurse_into, filter=filter, ignore_noattr=ignore_noattr, accept_list=['data'], orig_request=orig_request, orig_objs=orig_objs, return_httpresponse=False))
+                continue
+            obj = todata(obj)
+            if serializer is not None and isinstance(obj, models.Model):
+                data_list.append(serializer.serialize(request, obj, model=model, orig_request=orig_request, orig_objs=orig_objs))
+            else:
+                data_list.append(restGet(request, obj, model=model, fields=fields, extra=extra, exclude=exclude, fkey_depth=fkey_depth, recurse_into=recurse_into, filter=filter, ignore_noattr=ignore_noattr, accept_list=['data'], orig_request=orig_request, orig_objs=orig_objs))
 
     if not return_httpresponse:
         return data_list
@@ -886,8 +1620,9 @@ def restList(request, qset, model=None, size=25, start=0, sort=None, fields=None
 
     # build response
     ret["size"] = size
-    ret["count"] = count
-    ret["start"] = start
+    if rows is None:
+        ret["count"] = count
+        ret["start"] = start
     ret["data"] = data_list
     if sort_args:
         ret["sort"] = sort_args
@@ -911,17 +1646,7 @@ def updatePagination(request, qset, size, count, start, page):
     ordering = None
     if type(qset) == QuerySet and qset.query.can_filter():
         ordering = []
-        if not qset.ordered:
-            modelorder = []
-        elif qset.query.extra_order_by:
-            modelorder = qset.query.extra_order_by
-        elif not qset.query.default_ordering:
-            modelorder = qset.query.order_by
-        else:
-            modelorder = qset.query.order_by or qset.query.model._meta.ordering or []
-        modelorder = list(modelorder)
-        modelorder.append('pk')
-        qset = qset.order_by(*modelorder)
+        qset = qset.order_by(*_pagingOrder(qset))
         try:
             for o in qset.query.order_by:
                 rev = False
@@ -952,16 +1677,10 @@ def updatePagination(request, qset, size, count, start, page):
             if not name in page_data:
                 continue
             # pull page data by name
-            if isinstance(page_data[name], dict) and "datetime" in page_data[name]:
-                data = datetime.datetime.fromtimestamp(page_data[name]["datetime"][0])
-                data = data.replace(microsecond=page_data[name]["datetime"][1])
-            elif isinstance(page_data[name], dict) and "date" in page_data[name]:
-                data = datetime.date.fromtimestamp(page_data[name]["date"][0])
-            else:
-                data = page_data[name]
+            data = _pageValue(page_data[name])
 
             if type(qset) == QuerySet:
-                if rev == (page['_dir'] == '+'):
+                if rev == (page_data['_dir'] == '+'):
                     att = name + "__lt"
                 else:
                     att = name + "__gt"
@@ -1023,7 +1742,7 @@ def updatePagination(request, qset, size, count, start, page):
 
 # def restListQuerySet(request, )
 
-def restListEx(request, qset, model=None, size=25, start=0, sort=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, get_count=True, orig_request=None, orig_objs={}, page=None, ignore_noattr=False, todata=lambda x: x, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True):
+def restListEx(request, qset, model=None, size=25, start=0, sort=None, fields=None, extra=[], exclude=[], fkey_depth=0, recurse_into=[], filter={}, get_count=True, orig_request=None, orig_objs={}, page=None, ignore_noattr=False, todata=lambda x: x, require_perms=[], accept_list=None, featuresets={}, features=[], return_httpresponse=True, select_related=None, prefetch_related=None):
     """
     request: HttpRequest object
     qset: QuerySet or data object to return
@@ -1042,6 +1761,8 @@ def restListEx(request, qset, model=None, size=25, start=0, sort=None, fields=No
     ignore_noattr: (optional) ignore unknown attributes (default false)
     todata: (optional) function to convert per-element data into data for restGet
     accept_list: (optional) requested return format
+    select_related: (optional) foreign keys to join in, see RestModel.buildQueryPlan
+    prefetch_related: (optional) related sets to prefetch, see RestModel.buildQueryPlan
     RETURN: HttpResponse
 
     process a RESTful GET request to list a set of objects.  User is responsible for checking permissions, etc before calling.
@@ -1153,18 +1874,11 @@ def restListEx(request, qset, model=None, size=25, start=0, sort=None, fields=No
     # sane paging - get ordering list
     ordering = []
     try:
-        if type(qset) == QuerySet and qset.query.can_filter():
-            if not qset.ordered:
-                modelorder = []
-            elif qset.query.extra_order_by:
-                modelorder = qset.query.extra_order_by
-            elif not qset.query.default_ordering:
-                modelorder = qset.query.order_by
-            else:
-                modelorder = qset.query.order_by or qset.query.model._meta.ordering or []
-            modelorder = list(modelorder)
-            modelorder.append('pk')
-            qset = qset.order_by(*modelorder)
+        if type(qset) == QuerySet and qset._result_cache is not None:
+            # already evaluated (prefetched), ordering again would requery it
+            pass
+        elif type(qset) == QuerySet and qset.query.can_filter():
+            qset = qset.order_by(*_pagingOrder(qset))
             for o in qset.query.order_by:
                 rev = False
                 if o[0] == '-':
@@ -1323,6 +2037,7 @@ def restListEx(request, qset, model=None, size=25, start=0, sort=None, fields=No
             ret['data'][key] = rest_serialize(value)
     else:
         ret['data'] = []
+        qset = _applyQueryPlan(qset, select_related, prefetch_related)
         if qset:
             # # print fields
             for qr in qset:
@@ -1700,20 +2415,108 @@ def generateCSV(qset, fields, name, header_cols=None, values_list=False, output=
     a.mimetype = "text/csv"
     return a
 
+def _exportLookup(model, name):
+    """
+    returns (lookup, parent lookup) to read an export field with values_list,
+    or None when the field needs the model instance (properties, methods, sets)
+    """
+    parts = name.replace(".", "__").split("__")
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete:
+            return None
+        if field.is_relation:
+            if not (field.many_to_one or field.one_to_one):
+                return None
+            if last:
+                # the id when asked for by attname, otherwise flattenObject outputs str(obj)
+                if part != field.attname:
+                    return None
+                break
+            model = field.related_model
+        elif not last or type(getattr(model, field.attname, None)) is not DeferredAttribute:
+            return None
+    if len(parts) == 1:
+        return (name, None)
+    # the parent relation tells an empty relation ("") from an empty value
+    return ("__".join(parts), "__".join(parts[:-1]))
+
+
+def _exportPlan(model, field_names):
+    # values_list columns for the export fields, None if any field needs model instances
+    columns = []
+    steps = []
+    for f in field_names:
+        lookup = _exportLookup(model, f)
+        if lookup is None:
+            return None
+        lookup, parent = lookup
+        if lookup not in columns:
+            columns.append(lookup)
+        parent_index = None
+        if parent is not None:
+            if parent not in columns:
+                columns.append(parent)
+            parent_index = columns.index(parent)
+        steps.append((columns.index(lookup), parent_index))
+    return columns, steps
+
+
+def iterExportRows(qset, field_names, chunk_size=None):
+    """
+    generator of csv rows (same output as flattenObject) streamed from the database in chunks,
+    dotted fields are read through joins with values_list when possible
+    """
+    if chunk_size is None:
+        chunk_size = EXPORT_CHUNK_SIZE
+    plan = None
+    if qset._iterable_class is ModelIterable:
+        plan = _exportPlan(qset.model, field_names)
+    if plan is None:
+        related = []
+        for f in field_names:
+            f1 = f.replace(".", "__").split("__")[0]
+            if f1 not in related:
+                try:
+                    field = qset.model._meta.get_field(f1)
+                except FieldDoesNotExist:
+                    continue
+                if field.is_relation and field.concrete and (field.many_to_one or field.one_to_one):
+                    related.append(f1)
+        if related:
+            qset = qset.select_related(*related)
+        for obj in qset.iterator(chunk_size=chunk_size):
+            yield flattenObject(obj, field_names)
+        return
+    columns, steps = plan
+    for row in qset.values_list(*columns).iterator(chunk_size=chunk_size):
+        out = []
+        for index, parent_index in steps:
+            if parent_index is not None and row[parent_index] is None:
+                out.append("")
+            else:
+                out.append(str(row[index]))
+        yield out
+
+
 def iterCsvObject(items, writer, header, field_names):
     yield writer.writerow(header)
-    for item in items:
-        yield writer.writerow(flattenObject(item, field_names))
+    for row in iterExportRows(items, field_names):
+        yield writer.writerow(row)
 
-def generateCSVStream(qset, fields, name):
+def generateCSVStream(qset, fields, name, header_cols=None):
     import csv
-    # check if we support stream mode
     header, field_names = extractFieldNames(fields)
-    # rows = qset.values_list(*fields)
+    if header_cols:
+        header = header_cols
     pseudo_buffer = EchoWriter()
     writer = csv.writer(pseudo_buffer)
     return StreamingHttpResponse(
-        iterCsvObject(qset, writer, header, field_names))
+        iterCsvObject(qset, writer, header, field_names), content_type="text/csv")
 
 class EchoWriter(object):
     """An object that implements just the write method of the file-like
@@ -1727,28 +2530,178 @@ class EchoWriter(object):
         return value
 
 
+def iterJSONArray(items):
+    # encodes a json array one item at a time
+    yield "["
+    sep = ""
+    for item in items:
+        yield sep + toJSON(item)
+        sep = ",\n"
+    yield "]\n"
+
+
+def iterJSONLines(items):
+    for item in items:
+        yield toJSON(item) + "\n"
+
+
 def restFlat(request, qset, fields, name, size=10000, header_cols=None):
-    return HttpResponse(prettyJSON(list(qset.values_list(*fields))), content_type="application/json", status=200)
+    header, field_names = extractFieldNames(fields)
+    rows = qset.values_list(*[f.replace(".", "__") for f in field_names]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    convert = _nativeValue if NATIVE_JSON else rest_serialize
+    rows = ([convert(v) for v in row] for row in rows)
+    return StreamingHttpResponse(iterJSONArray(rows), content_type="application/json", status=200)
 
 
 def restCSV(request, qset, fields, name, size=10000, header_cols=None):
-    if size > 1200 and qset.count() > 1200:
-        # large data set lets stream
-        qset = qset[:size]
-        response = generateCSVStream(qset, fields, name)
-        response['Cache-Control'] = 'no-cache'
-        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
-    else:
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
-        qset = qset[:size]
-        generateCSV(qset, fields, name, output=response, header_cols=header_cols)
+    # streamed in chunks so large exports run in constant memory
+    qset = qset[:size]
+    response = generateCSVStream(qset, fields, name, header_cols)
+    response['Cache-Control'] = 'no-cache'
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
     return response
 
 
 def restJSON(request, qset, fields, name, size=10000):
-    data = restList(None, qset, fields=fields, size=size, accept_list=["application/json"], return_httpresponse=False)
-    response = HttpResponse(prettyJSON(data), content_type="application/json")
+    serializer = GraphSerializer(fields=fields, native=NATIVE_JSON)
+    response = StreamingHttpResponse(iterJSONArray(serializer.iterate(None, qset[:size])), content_type="application/json")
+    response['Cache-Control'] = 'no-cache'
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
+    return response
+
+
+def restNDJSON(request, qset, fields, name, size=10000):
+    serializer = GraphSerializer(fields=fields, native=NATIVE_JSON)
+    response = StreamingHttpResponse(iterJSONLines(serializer.iterate(None, qset[:size])), content_type="application/x-ndjson")
+    response['Cache-Control'] = 'no-cache'
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
+    return response
+
+
+def iterCompressed(chunks, method="gz"):
+    # compresses a stream of text chunks, gzip or zstd
+    if method == "zst":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def restCSVCompressed(request, qset, fields, name, size=10000, header_cols=None, method="gz"):
+    if method == "zst" and zstandard is None:
+        return restStatus(request, False, error="csv.zst export requires zstandard")
+    import csv
+    header, field_names = extractFieldNames(fields)
+    if header_cols:
+        header = header_cols
+    writer = csv.writer(EchoWriter())
+    chunks = iterCsvObject(qset[:size], writer, header, field_names)
+    content_type = "application/zstd" if method == "zst" else "application/gzip"
+    response = StreamingHttpResponse(iterCompressed(chunks, method), content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
+    return response
+
+
+def _exportField(model, lookup):
+    # the model field at the end of an export lookup
+    field = None
+    for part in lookup.split("__"):
+        field = model._meta.get_field(part)
+        if field.is_relation:
+            model = field.related_model
+    if field.is_relation:
+        field = field.target_field
+    return field
+
+
+_ARROW_INTS = ("AutoField", "BigAutoField", "SmallAutoField", "IntegerField", "BigIntegerField", "SmallIntegerField",
+               "PositiveIntegerField", "PositiveBigIntegerField", "PositiveSmallIntegerField")
+
+
+def _arrowType(field):
+    kind = field.get_internal_type() if field is not None else None
+    if kind in _ARROW_INTS:
+        return pyarrow.int64()
+    if kind == "FloatField":
+        return pyarrow.float64()
+    if kind == "DecimalField":
+        # decimal128 holds at most 38 digits, decimal256 at most 76
+        if field.max_digits <= 38:
+            return pyarrow.decimal128(field.max_digits, field.decimal_places)
+        if field.max_digits <= 76:
+            return pyarrow.decimal256(field.max_digits, field.decimal_places)
+        return pyarrow.string()
+    if kind in ("BooleanField", "NullBooleanField"):
+        return pyarrow.bool_()
+    if kind == "DateTimeField":
+        return pyarrow.timestamp("us")
+    if kind == "DateField":
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+def _arrowBatch(schema, rows):
+    arrays = []
+    for i, column in enumerate(zip(*rows)):
+        ftype = schema.field(i).type
+        if ftype == pyarrow.string():
+            column = [v if v is None or isinstance(v, str) else str(v) for v in column]
+        arrays.append(pyarrow.array(column, type=ftype))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def generateArrow(qset, fields, output, format="parquet", chunk_size=None):
+    """
+    writes qset as a parquet or arrow ipc file to output, built in batches of chunk_size rows.
+    column fields keep their database types, anything else is written as the csv text
+    """
+    if chunk_size is None:
+        chunk_size = EXPORT_CHUNK_SIZE
+    header, field_names = extractFieldNames(fields)
+    plan = None
+    if qset._iterable_class is ModelIterable:
+        plan = _exportPlan(qset.model, field_names)
+    if plan is None:
+        types = [pyarrow.string()] * len(field_names)
+        rows = iterExportRows(qset, field_names, chunk_size)
+    else:
+        columns, steps = plan
+        types = [_arrowType(_exportField(qset.model, columns[index])) for index, parent_index in steps]
+        values = qset.values_list(*columns).iterator(chunk_size=chunk_size)
+        rows = ([None if p is not None and row[p] is None else row[i] for i, p in steps] for row in values)
+    schema = pyarrow.schema([(str(h), t) for h, t in zip(header, types)])
+    if format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(output, schema)
+        write = lambda batch: writer.write_table(pyarrow.Table.from_batches([batch]))
+    else:
+        writer = pyarrow.ipc.new_file(output, schema)
+        write = writer.write_batch
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            write(_arrowBatch(schema, batch))
+            batch = []
+    if batch:
+        write(_arrowBatch(schema, batch))
+    writer.close()
+    return output
+
+
+def restArrow(request, qset, fields, name, size=10000, format="parquet"):
+    if pyarrow is None:
+        return restStatus(request, False, error="{} export requires pyarrow".format(format))
+    output = tempfile.TemporaryFile()
+    generateArrow(qset[:size], fields, output, format)
+    output.seek(0)
+    content_type = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file"
+    response = FileResponse(output, content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
     response['Content-Disposition'] = 'attachment; filename="{0}"'.format(name)
     return response
 
@@ -30,6 +30,21 @@ TASK_STATES = [
     (TASK_STATE_CANCELED, 'canceled')
 ]
 
+# sorted set of task pks scored by when they are due, fired by the WorkManager timer
+TQ_DELAYED_KEY = "tq:delayed"
+
+# "pubsub" is the fire and forget PUBLISH to every subscribed worker,
+# "stream" delivers each task to exactly one worker through redis streams and survives restarts,
+# switch producers and workers together
+TQ_TRANSPORT = getattr(settings, "TQ_TRANSPORT", "pubsub")
+TQ_STREAM_MAXLEN = getattr(settings, "TQ_STREAM_MAXLEN", 100000)
+TQ_STREAM_GROUP = "tq_workers"
+
+
+def getStreamKey(channel):
+    return F"tq:stream:{channel}"
+
+
 def getAppHandler(app_name, fname):
     try:
         # module = __import__(app_name + '.tq', globals(), locals(), ['*'], 0)
@@ -174,6 +189,16 @@ class Task(models.Model, RestModel):
         self.state = TASK_STATE_RETRY
         self.cancel_requested = False
         self.save()
+        if from_now_secs:
+            self.scheduleTimer()
+
+    def scheduleTimer(self):
+        # the WorkManager timer publishes the task again once scheduled_for passes
+        try:
+            RemoteEvents.zadd(TQ_DELAYED_KEY, {self.pk: self.scheduled_for.timestamp()})
+        except Exception:
+            # the run_retry periodic still picks it up
+            self.log_exception("failed to add task timer")
 
     def retry_now(self):
         self.state = TASK_STATE_SCHEDULED
@@ -220,6 +245,8 @@ class Task(models.Model, RestModel):
         out.data = self.data
         if not channel:
             channel = self.channel
+        if TQ_TRANSPORT == "stream":
+            return RemoteEvents.xadd(getStreamKey(channel), {"data": out.toJSON(as_string=True)}, maxlen=TQ_STREAM_MAXLEN)
         return RemoteEvents.publish(channel, out)
 
     def getHandler(self):
@@ -296,8 +323,8 @@ class Task(models.Model, RestModel):
         return task
 
     @classmethod
-    def PublishModelTask(cls, model_name, fname, data, stale_after_seconds=0, channel="tq_model_handler", scheduled_for=scheduled_for):
-        return cls.Publish(cls, model_name, fname, data, stale_after_seconds, channel, scheduled_for)
+    def PublishModelTask(cls, model_name, fname, data, stale_after_seconds=0, channel="tq_model_handler", scheduled_for=None):
+        return cls.Publish(model_name, fname, data, stale_after_seconds, channel, scheduled_for)
 
     @classmethod
     def Publish(cls, app_name, fname, data=None, stale_after_seconds=0, channel="tq_app_handler", scheduled_for=None):
@@ -309,6 +336,7 @@ class Task(models.Model, RestModel):
             # this means we just save as a retry, and let it be scheduled for later
             task.state = TASK_STATE_RETRY
             task.save()
+            task.scheduleTimer()
             return task
         task.save()
         task.publish(channel)
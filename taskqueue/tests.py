@@ -0,0 +1,90 @@
+from django.test import TestCase
+from unittest import mock, skipUnless
+import json
+import logging
+
+from taskqueue import worker
+from taskqueue.models import Task, getStreamKey, TQ_STREAM_GROUP
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipUnless(fakeredis, "needs fakeredis")
+class StreamTransportTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeStrictRedis()
+        for target in ["taskqueue.worker.getRedisClient", "ws4redis.client.getRedisClient"]:
+            patcher = mock.patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = worker.WorkManager(worker_count=1, subscribe_to=["tq_test"], logger=logging.getLogger("tq_test"))
+        self.addCleanup(self.manager._pool.shutdown)
+        # tasks are only scheduled, nothing runs in the pool
+        self.manager.submitTask = mock.Mock()
+        self.manager.consumer = "live:1"
+        self.manager.streamHeartbeat()
+        self.stream = getStreamKey("tq_test")
+        self.redis.xgroup_create(self.stream, TQ_STREAM_GROUP, id="0", mkstream=True)
+
+    def newTask(self):
+        return Task.objects.create(channel="tq_test", model="tapp.Item", fname="on_tq")
+
+    def deliver(self, consumer, task):
+        self.redis.xadd(self.stream, {"data": json.dumps({"pk": task.pk})})
+        return self.redis.xreadgroup(TQ_STREAM_GROUP, consumer, {self.stream: ">"}, count=10)
+
+    def pending(self):
+        return self.redis.xpending_range(self.stream, TQ_STREAM_GROUP, min="-", max="+", count=10)
+
+    def test_ack_on_completion(self):
+        task = self.newTask()
+        for stream, entries in self.deliver(self.manager.consumer, task):
+            for entry_id, fields in entries:
+                self.manager.addStreamEntry(stream, entry_id, fields)
+        self.assertIn(task.pk, self.manager._scheduled_tasks)
+        self.assertEqual(len(self.pending()), 1)
+        scheduled = self.manager._scheduled_tasks[task.pk]
+        self.manager.on_task_started(scheduled)
+        self.manager.on_task_ended(scheduled)
+        self.assertEqual(self.pending(), [])
+        self.assertEqual(self.redis.xlen(self.stream), 0)
+
+    def test_reclaim_dead_consumer(self):
+        dead_task = self.newTask()
+        self.deliver("dead:2", dead_task)
+        busy_task = self.newTask()
+        self.deliver("busy:3", busy_task)
+        self.redis.set("tq:consumer:busy:3", 1)
+        with mock.patch("taskqueue.worker.TQ_CONSUMER_TTL", 0):
+            self.manager.reclaimStreams()
+        self.assertIn(dead_task.pk, self.manager._scheduled_tasks)
+        self.assertNotIn(busy_task.pk, self.manager._scheduled_tasks)
+        owners = {int(json.loads(fields[b"data"])["pk"]): entry["consumer"] for entry in self.pending()
+                  for _, fields in self.redis.xrange(self.stream, entry["message_id"], entry["message_id"])}
+        self.assertEqual(owners, {dead_task.pk: b"live:1", busy_task.pk: b"busy:3"})
+
+    def test_drain_marked_after_backlog_moved(self):
+        tasks = [self.newTask() for i in range(3)]
+        publish = Task.publish
+        calls = []
+
+        def failing(task, channel=None):
+            calls.append(task.pk)
+            if len(calls) == 2:
+                raise RuntimeError("redis went away")
+            return publish(task, channel)
+
+        with mock.patch("taskqueue.models.TQ_TRANSPORT", "stream"):
+            with mock.patch.object(Task, "publish", failing):
+                with self.assertRaises(RuntimeError):
+                    self.manager.drainBacklog()
+            self.assertFalse(self.redis.exists(self.stream + ":drained"))
+            self.assertFalse(self.redis.exists(self.stream + ":draining"))
+            # the next worker moves the whole backlog
+            self.manager.drainBacklog()
+        self.assertTrue(self.redis.exists(self.stream + ":drained"))
+        moved = [int(json.loads(fields[b"data"])["pk"]) for _, fields in self.redis.xrange(self.stream)]
+        self.assertEqual(sorted(set(moved)), [task.pk for task in tasks])
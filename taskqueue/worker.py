@@ -1,6 +1,10 @@
 
 import requests
 import threading
+import socket
+import os
+import heapq
+import itertools
 from concurrent import futures
 
 from redis import ConnectionPool, StrictRedis
@@ -19,9 +23,20 @@ from rest.uberdict import UberDict
 from datetime import datetime, timedelta
 import time
 from django.conf import settings
+from django import db
 
 TQ_WORKERS = getattr(settings, "TQ_WORKERS", 4)
 TQ_SUBSCRIBE = getattr(settings, "TQ_SUBSCRIBE", [])
+# channels with their own worker pool, ie {"tq_app_handler_cleanup": 1, "tq_hook": 4}
+TQ_CHANNEL_WORKERS = getattr(settings, "TQ_CHANNEL_WORKERS", {})
+# max tasks started per second by channel, ie {"tq_hook": 10}
+TQ_CHANNEL_RATE_LIMITS = getattr(settings, "TQ_CHANNEL_RATE_LIMITS", {})
+# seconds between checks for delayed tasks that are due
+TQ_TIMER_INTERVAL = getattr(settings, "TQ_TIMER_INTERVAL", 0.5)
+# stream transport: stream entries of a worker whose heartbeat is older than this get reclaimed
+TQ_CONSUMER_TTL = getattr(settings, "TQ_CONSUMER_TTL", 60)
+# stream transport: seconds one worker may hold the lock while moving the pubsub backlog
+TQ_DRAIN_LOCK_TTL = getattr(settings, "TQ_DRAIN_LOCK_TTL", 300)
 
 logger = None
 
@@ -45,16 +60,53 @@ class WorkManager(object):
         self._scheduled_tasks = {}
         self._running_count = 0
         self._pending_count = 0
+        # heap of (due, seq, task) waiting on a channel rate limit
+        self._delayed = []
+        self._delayed_seq = itertools.count()
+        self._next_slot = {}
+        self._timer = None
+        # stream transport, task pk -> [(stream, entry id)] to ack when the task ends
+        self._stream_acks = {}
+        self.consumer = None
+        self._last_heartbeat = 0
         self.is_running = False
         self.lock = threading.RLock()
         if not self.logger:
             self.logger = getLogger("root", filename="tq_worker.log")
         self.logger.info("starting manager, workers: {}".format(self.worker_count))
         self.logger.info("handling: {}".format(self.subscribe_to))
+        self._pool = self.newPool(self.worker_count)
+        # dedicated pools so slow channels cannot starve the others
+        self._pools = {}
+        self.capacity = self.worker_count
+        for channel, count in kwargs.get("channel_workers", TQ_CHANNEL_WORKERS).items():
+            self.logger.info("channel {} workers: {}".format(channel, count))
+            self._pools[channel] = self.newPool(count)
+            self.capacity += count
+        self.rate_limits = kwargs.get("rate_limits", TQ_CHANNEL_RATE_LIMITS)
+
+    def newPool(self, worker_count):
         if USE_THREADS:
-            self._pool = futures.ThreadPoolExecutor(max_workers=self.worker_count)
-        else:
-            self._pool = futures.ProcessPoolExecutor(max_workers=self.worker_count)
+            return futures.ThreadPoolExecutor(max_workers=worker_count)
+        return futures.ProcessPoolExecutor(max_workers=worker_count)
+
+    def getPool(self, channel):
+        return self._pools.get(channel, self._pool)
+
+    def getRateSlot(self, channel):
+        # returns when the next task on channel may start, None if it can start now
+        rate = self.rate_limits.get(channel, None)
+        if not rate:
+            return None
+        now = time.time()
+        slot = max(now, self._next_slot.get(channel, 0))
+        self._next_slot[channel] = slot + (1.0 / rate)
+        if slot > now:
+            return slot
+        return None
+
+    def submitTask(self, task):
+        task.future = self.getPool(task.channel).submit(self.on_run_task, task)
 
     def updateCounts(self):
         self.logger.info("running: {} --- pending: {}".format(self._running_count, self._pending_count))
@@ -70,11 +122,67 @@ class WorkManager(object):
         task.manager = self
         with self.lock:
             task.worker_running = False
+            task.future = None
             self._scheduled_tasks[task.id] = task
             self._pending_count += 1
-            task.future = self._pool.submit(self.on_run_task, task)
+            due = self.getRateSlot(task.channel)
+            if due is None:
+                self.submitTask(task)
+            else:
+                heapq.heappush(self._delayed, (due, next(self._delayed_seq), task))
         self.updateCounts()
 
+    def fireRateLimited(self):
+        # submit tasks whose rate limit slot has arrived
+        now = time.time()
+        with self.lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                due, seq, task = heapq.heappop(self._delayed)
+                if self._scheduled_tasks.get(task.id, None) is task and task.future is None:
+                    self.submitTask(task)
+
+    def fireDueTasks(self, limit=100):
+        # publish delayed and retry tasks whose scheduled_for has passed
+        pks = RemoteEvents.zrangebyscore(TQ_DELAYED_KEY, "-inf", time.time(), 0, limit)
+        for pk in pks:
+            if not RemoteEvents.zrem(TQ_DELAYED_KEY, pk):
+                # another worker claimed it
+                continue
+            task = Task.objects.filter(pk=int(pk), state=TASK_STATE_RETRY).last()
+            if task is None:
+                continue
+            if task.is_stale:
+                task.failed("stale")
+            else:
+                task.retry_now()
+
+    def run_timer(self):
+        try:
+            self.timerLoop()
+        finally:
+            # this thread's connection is not closed by any request cycle
+            db.connection.close()
+
+    def timerLoop(self):
+        while self.is_running:
+            try:
+                # drop connections the database closed (restart, idle timeout)
+                db.close_old_connections()
+                self.fireRateLimited()
+                self.fireDueTasks()
+                if self.consumer and time.time() - self._last_heartbeat > TQ_CONSUMER_TTL / 4:
+                    self._last_heartbeat = time.time()
+                    self.streamHeartbeat()
+                    self.reclaimStreams()
+            except Exception as err:
+                self.logger.exception(err)
+            wait = TQ_TIMER_INTERVAL
+            with self.lock:
+                if self._delayed:
+                    # wake up for the next rate limited slot
+                    wait = min(wait, max(0.01, self._delayed[0][0] - time.time()))
+            time.sleep(wait)
+
     def addEvent(self, event):
         # self.logger.info("processing event", event)
         if event.type == "subscribe":
@@ -109,9 +217,13 @@ class WorkManager(object):
             task.reason = reason
             task.save()
             return
-        if not hasattr(cached_task, "future"):
+        if getattr(cached_task, "future", None) is None:
+            # still waiting on a rate limit, drop it before it is submitted
             self.removeTask(cached_task)
-            self.logger.error("task has no future!")
+            self.logger.info("canceled rate limited task({})".format(task.id))
+            task.state = -2
+            task.reason = reason
+            task.save()
             return
         task = cached_task
         if task.future.running():
@@ -155,9 +267,75 @@ class WorkManager(object):
                 self.updateCounts()
         except:
             pass
+        self.ackTask(task.id)
+
+    def getStreams(self):
+        return [getStreamKey(channel) for channel in self.subscribe_to]
+
+    def addStreamEntry(self, stream, entry_id, fields):
+        # a task delivered only to this worker, acked once it ends
+        if isinstance(stream, bytes):
+            stream = stream.decode()
+        data = fields.get(b"data", None)
+        event = UberDict(type="message", channel=stream[len(getStreamKey("")):], data=data)
+        pk = UberDict.fromJSON(data).pk if data else None
+        if pk is None:
+            getRedisClient().xack(stream, TQ_STREAM_GROUP, entry_id)
+            return
+        with self.lock:
+            self._stream_acks.setdefault(pk, []).append((stream, entry_id))
+        try:
+            self.addEvent(event)
+        except Exception:
+            # leave it pending, it is reclaimed once this consumer is gone
+            with self.lock:
+                self._stream_acks.pop(pk, None)
+            raise
+        if pk not in self._scheduled_tasks:
+            # not scheduled (unknown, stale or canceled), nothing will ack it later
+            self.ackTask(pk)
+
+    def ackTask(self, pk):
+        with self.lock:
+            entries = self._stream_acks.pop(pk, None)
+        if not entries:
+            return
+        pipe = getRedisClient().pipeline(transaction=False)
+        for stream, entry_id in entries:
+            pipe.xack(stream, TQ_STREAM_GROUP, entry_id)
+            pipe.xdel(stream, entry_id)
+        pipe.execute()
+
+    def streamHeartbeat(self):
+        getRedisClient().set(F"tq:consumer:{self.consumer}", int(time.time()), ex=TQ_CONSUMER_TTL)
+
+    def reclaimStreams(self, limit=100):
+        # take over entries delivered to workers that died before acking them
+        client = getRedisClient()
+        idle_ms = TQ_CONSUMER_TTL * 1000
+        for stream in self.getStreams():
+            pending = client.xpending_range(stream, TQ_STREAM_GROUP, min="-", max="+", count=limit, idle=idle_ms)
+            dead = {}
+            for entry in pending:
+                consumer = helpers.toString(entry["consumer"])
+                if consumer == self.consumer:
+                    continue
+                if consumer not in dead:
+                    dead[consumer] = not client.exists(F"tq:consumer:{consumer}")
+                if dead[consumer]:
+                    for entry_id, fields in client.xclaim(stream, TQ_STREAM_GROUP, self.consumer, idle_ms, [entry["message_id"]]):
+                        if fields:
+                            self.logger.info("reclaimed {} from {}".format(helpers.toString(entry_id), consumer))
+                            self.addStreamEntry(stream, entry_id, fields)
 
 
     def processBacklog(self):
+        if TQ_TRANSPORT == "stream":
+            self.drainBacklog()
+            return
+        if self.subscribe_to:
+            # tasks published from now on are not in the streams, drain again when switching back
+            getRedisClient().delete(*[F"{key}:drained" for key in self.getStreams()])
         tasks = Task.objects.filter(state__in=[0,1,2])
         for task in tasks:
             if task.channel in self.subscribe_to:
@@ -173,6 +351,34 @@ class WorkManager(object):
             else:
                 self.logger.warning("ignore job {}:{}".format(task.id, task.channel))
 
+    def drainBacklog(self):
+        # undelivered and unacked tasks stay in the streams, only the tasks left over
+        # from the pubsub transport are moved into them, once per channel by one worker
+        client = getRedisClient()
+        for channel in self.subscribe_to:
+            key = getStreamKey(channel)
+            if client.exists(F"{key}:drained"):
+                continue
+            # the lock expires if this worker dies midway, the next one drains again
+            if not client.set(F"{key}:draining", int(time.time()), nx=True, ex=TQ_DRAIN_LOCK_TTL):
+                continue
+            try:
+                tasks = Task.objects.filter(state__in=[0,1,2], channel=channel)
+                for task in tasks:
+                    if task.cancel_requested:
+                        self.logger.info("task has cancel request {}".format(task.id))
+                        task.state = -2
+                        if not task.reason:
+                            task.reason = "task canceled"
+                        task.save()
+                        continue
+                    self.logger.debug("moving job {} to stream".format(task.id))
+                    task.publish()
+                # only marked once every task made it into the stream
+                client.set(F"{key}:drained", int(time.time()))
+            finally:
+                client.delete(F"{key}:draining")
+
     def _on_webrequest(self, task):
         self.logger.debug("starting webrequest to: {}".format(task.data.url))
         # we need to copy the data and remove the url
@@ -219,6 +425,7 @@ class WorkManager(object):
             del self._scheduled_tasks[task.id]
             self._running_count -= 1
             self.updateCounts()
+        self.ackTask(task.id)
 
     def on_run_task(self, task):
         self.logger.info("running task({})".format(task.id))
@@ -293,8 +500,15 @@ class WorkManager(object):
     def run_forever(self):
         self.logger.info("starting work manager...")
         self.is_running = True
+        self._timer = threading.Thread(target=self.run_timer, daemon=True)
+        self._timer.start()
         client = getRedisClient()
         sub = client.pubsub()
+        if TQ_TRANSPORT == "stream":
+            sub.subscribe("tq_cancel")
+            sub.subscribe("tq_restart")
+            self.run_streams(client, sub)
+            return
         for key in self.subscribe_to:
             self.logger.info("subscribing to: {}".format(key))
             sub.subscribe(key)
@@ -312,6 +526,50 @@ class WorkManager(object):
                     except Exception as err:
                         self.logger.exception(err)
 
+    def run_streams(self, client, sub):
+        self.consumer = "{}:{}".format(socket.gethostname(), os.getpid())
+        streams = {}
+        for key in self.getStreams():
+            self.logger.info("consuming: {} as {}".format(key, self.consumer))
+            try:
+                client.xgroup_create(key, TQ_STREAM_GROUP, id="0", mkstream=True)
+            except Exception as err:
+                if "BUSYGROUP" not in str(err):
+                    raise
+            streams[key] = ">"
+        names = list(streams)
+        offset = 0
+        self.streamHeartbeat()
+        self.logger.info("listening for incoming tasks...")
+        while self.is_running:
+            try:
+                # control events (cancel/restart) still come over pubsub
+                event = sub.get_message()
+                while event is not None and self.is_running:
+                    event = UberDict.fromdict(event)
+                    event.channel = helpers.toString(event.channel)
+                    self.addEvent(event)
+                    event = sub.get_message()
+                # only take what we can run so idle workers on other nodes get the rest
+                free = self.capacity - self._running_count - self._pending_count
+                if free <= 0:
+                    time.sleep(0.1)
+                    continue
+                # count applies to each stream, so split what is free between them
+                batch, count = streams, free // len(names)
+                if free < len(names):
+                    # fewer free slots than streams, take one entry from each of the next <free> streams
+                    keys = names[offset:] + names[:offset]
+                    batch, count = {key: ">" for key in keys[:free]}, 1
+                    offset = (offset + free) % len(names)
+                resp = client.xreadgroup(TQ_STREAM_GROUP, self.consumer, batch, count=count, block=1000)
+                for stream, entries in resp or []:
+                    for entry_id, fields in entries:
+                        self.addStreamEntry(stream, entry_id, fields)
+            except Exception as err:
+                self.logger.exception(err)
+                time.sleep(1.0)
+
     def restart(self):
         if self.service:
             self.is_running = False
@@ -327,8 +585,10 @@ class WorkManager(object):
             RemoteEvents.publish("tq_cancel", {"pk":1})
             with self.lock:
                 self.updateCounts()
+                # rate limited tasks are still scheduled in the db and resubmitted by processBacklog
+                self._delayed = []
                 for key, task in list(self._scheduled_tasks.items()):
-                    if not hasattr(task, "future"):
+                    if getattr(task, "future", None) is None:
                         continue
                     if not task.future.running():
                         task.future.cancel()
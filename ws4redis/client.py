@@ -2,7 +2,7 @@ import time
 
 from rest import UberDict
 
-from ws4redis.redis import RedisMessage, RedisStore, getRedisClient
+from ws4redis.redis import RedisMessage, RedisStore, getRedisClient, parseBacklogMessage
 
 
 def buildEventMessage(name, message=None, priority=0, model=None, model_pk=None, custom=None):
@@ -107,6 +107,30 @@ def hincrby(name, field, inc=1):
     return c.hincrby(name, field, inc)
 
 
+# SORTED SET FUNCTIONS
+def zadd(name, mapping):
+    # mapping of {member: score}
+    c = getRedisClient()
+    return c.zadd(name, mapping)
+
+
+def zrem(name, *values):
+    c = getRedisClient()
+    return c.zrem(name, *values)
+
+
+def zrangebyscore(name, min_score, max_score, start=None, num=None):
+    c = getRedisClient()
+    return c.zrangebyscore(name, min_score, max_score, start=start, num=num)
+
+
+# STREAM FUNCTIONS
+def xadd(name, fields, maxlen=None):
+    # append fields to the stream, approximately capped at maxlen entries
+    c = getRedisClient()
+    return c.xadd(name, fields, maxlen=maxlen, approximate=True)
+
+
 def sendToUser(user, name, message=None, priority=0, model=None, model_pk=None, custom=None):
     return sendMessageToUsers([user], buildEventMessage(name, message, priority, model, model_pk, custom))
 
@@ -116,7 +140,11 @@ def sendToUsers(users, name, message=None, priority=0, model=None, model_pk=None
 
 
 def sendMessageToUsers(users, msg):
-    return RedisStore().publish(RedisMessage(msg), channel="user", pk=[u.username for u in users])
+    if hasattr(users, "values_list"):
+        usernames = users.values_list("username", flat=True)
+    else:
+        usernames = [u.username for u in users]
+    return sum(publishMany("user", usernames, msg).values())
 
 
 def sendToGroup(group, name, message=None, priority=0, model=None, model_pk=None, custom=None):
@@ -128,7 +156,16 @@ def sendToGroups(groups, name, message=None, priority=0, model=None, model_pk=No
 
 
 def sendMessageToModels(channel, models, msg):
-    return RedisStore().publish(RedisMessage(msg), channel=channel, pk=[g.pk for g in models])
+    if hasattr(models, "values_list"):
+        pks = models.values_list("pk", flat=True)
+    else:
+        pks = [g.pk for g in models]
+    return sum(publishMany(channel, pks, msg).values())
+
+
+def publishMany(channel, pks, msg, facility="events", coalesce=None, use_script=False):
+    # pipelined publish of one message to many pks, returns {channel_key: count}
+    return RedisStore().publishMany(RedisMessage(msg), channel, pks, facility, coalesce=coalesce, use_script=use_script)
 
 
 def sendMessageToPK(channel, pk, msg):
@@ -165,7 +202,8 @@ def waitForMessage(pubsub, msg_filter):
         message = pubsub.get_message()
         if message is not None:
             if message.get("type") == "message":
-                msg = UberDict.fromJSON(message.get("data"))
+                msg_id, data = parseBacklogMessage(message.get("data"))
+                msg = UberDict.fromJSON(data)
                 if msg_filter(msg):
                     pubsub.unsubscribe()
                     return msg
@@ -1,12 +1,11 @@
 import time
-from rest.jwtoken import JWToken
 from rest import UberDict
 from rest.crypto import util
 from django.core.handlers.wsgi import WSGIRequest
 from django.apps import apps
 
 from ws4redis import settings as private_settings
-from ws4redis.redis import RedisStore, RedisMessage
+from ws4redis.redis import RedisStore, RedisMessage, parseBacklogMessage
 
 from rest.log import getLogger
 logger = getLogger("async", filename="async.log")
@@ -58,47 +57,43 @@ class WebsocketConnection():
         if self.credentials is None or self.credentials.pk is None:
             logger.error("invalid credentials for", msg, self.credentials)
             raise Exception("invalid credentials")
-        self.on_authenticated()
+        self.on_authenticated(msg.last_id)
 
     def on_auth_jwt(self, msg):
-        token = JWToken(msg.token)
-        if token.payload is None:
-            raise Exception("invalid auth token")
-        Member = apps.get_model("account", "Member")
-        member = Member.objects.filter(pk=token.payload.user_id).last()
-        if member is None:
-            raise Exception("invalid user token")
-        token.key = member.security_token
-        if not token.is_valid:
-            raise Exception("invalid signature")
-        if not token.isExpired():
-            raise Exception("token expired")
-        member.canLogin(self.request)
+        # imported here, the jwt middleware loads the account models
+        from rest.middleware.jwt import getMemberFromJWT
+        token, member = getMemberFromJWT(msg.token, self.request)
+        if token is None:
+            raise Exception(member)
         self.credentials = UberDict(kind="member", instance=member, pk=member.pk, uuid=member.username)
-        self.on_authenticated()
+        self.on_authenticated(msg.last_id)
  
-    def on_authenticated(self):
+    def on_authenticated(self, last_id=None):
         logger.info(F"authenticated {self.credentials.kind}: {self.credentials.uuid}")
         if self.credentials.kind == "member":
             channel_key = self.redis.subscribe("user", self.facility, self.credentials.uuid)
-            self.forwardPending(channel_key)
+            self.forwardPending(channel_key, last_id)
         else:
             channel_key = self.redis.subscribe(self.credentials.kind, self.facility, self.credentials.uuid)
-            self.forwardPending(channel_key)
+            self.forwardPending(channel_key, last_id)
 
         self.redis.publishModelOnline(self.credentials.kind, self.credentials.pk, only_one=self.credentials.only_one)
         self.refreshFDs()
 
-    def forwardPending(self, channel_key):
-        msg = self.redis.getPendingMessage(channel_key)
-        if msg:
-            logger.info("pending messages", repr(msg))
+    def forwardPending(self, channel_key, last_id=None):
+        # replay the channel backlog published after the client's last seen id
+        pending = self.redis.getPendingMessages(channel_key, last_id)
+        if pending:
+            logger.info(F"replaying {len(pending)} pending messages to {channel_key}")
             channel, pk = self.parseChannel(channel_key)
-            self.sendToWS(channel, msg, pk)
+            for msg_id, msg in pending:
+                self.sendToWS(channel, msg.decode(), pk, msg_id=msg_id)
 
     def on_resubscribe(self, msg):
         for ch in msg.channels:
-            self.redis.subscribe(ch.channel, self.facility, ch.pk)
+            ch = UberDict(ch)
+            channel_key = self.redis.subscribe(ch.channel, self.facility, ch.pk)
+            self.forwardPending(channel_key, ch.last_id)
 
     def getAppModel(self, app_model):
         if app_model not in MODEL_CACHE:
@@ -117,6 +112,7 @@ class WebsocketConnection():
         if bool(pks):
             for pk in pks:
                 channel_key = self.redis.subscribe(msg.channel, self.facility, pk)
+                self.forwardPending(channel_key, msg.last_id)
         else:
             logger.warning("subscribe permission denied", msg)
             self.sendToWS(msg.channel, dict(error="subscribe permission denied"))
@@ -193,10 +189,12 @@ class WebsocketConnection():
             logger.info("incoming redis msg", sub_resp)
             self.on_redis_msg(sub_resp)
 
-    def sendToWS(self, channel, message, pk=None):
+    def sendToWS(self, channel, message, pk=None, msg_id=None):
         msg = UberDict(channel=channel)
         if pk is not None:
             msg.pk = pk
+        if msg_id is not None:
+            msg.id = msg_id
         if isinstance(message, (str, bytes)):
             msg.message = UberDict.fromJSON(message, ignore_errors=True)
         if not msg.message:
@@ -227,7 +225,8 @@ class WebsocketConnection():
                 return
             elif sub_resp[0] == b'message':
                 channel, pk = self.parseChannel(sub_resp[1].decode())
-                self.sendToWS(channel, sub_resp[2].decode(), pk)
+                msg_id, data = parseBacklogMessage(sub_resp[2])
+                self.sendToWS(channel, data.decode(), pk, msg_id=msg_id)
                 return
         sendmsg = RedisMessage(sub_resp)
         logger.info(sub_resp)
@@ -267,11 +266,8 @@ class WebsocketConnection():
         if self.websocket:
             self.websocket.close(code=1001, message='Websocket Closed')
 
-    def handleComs(self):
+    def on_url_auth(self):
         # check if token is in url
-        websocket_fd = self.websocket.get_file_descriptor()
-        self.listening_fds = [websocket_fd]
-
         token = self.request.GET.get("token", None)
         if token is not None and private_settings.URL_AUTHENTICATOR is not None:
             self.on_auth(UberDict(kind=private_settings.URL_AUTHENTICATOR, token=token))
@@ -280,6 +276,11 @@ class WebsocketConnection():
         if session_key is not None:
             self.on_auth(UberDict(kind="session", token=session_key))
 
+    def handleComs(self):
+        websocket_fd = self.websocket.get_file_descriptor()
+        self.listening_fds = [websocket_fd]
+        self.on_url_auth()
+
         no_cred_count = 0
         
         while self.websocket and not self.websocket.closed:
@@ -1,4 +1,5 @@
 from redis import ConnectionPool, StrictRedis
+import hashlib
 
 from ws4redis import settings
 
@@ -8,6 +9,38 @@ logger = getLogger("async", filename="async.log")
 
 REDIS_CON_POOL = None
 
+# publishes the same message to every channel in ARGV[2..n], returns the receiver counts
+PUBLISH_MANY_SCRIPT = """
+local counts = {}
+for i = 2, #ARGV do
+    counts[i - 1] = redis.call('PUBLISH', ARGV[i], ARGV[1])
+end
+return counts
+"""
+
+# appends the message to each channel backlog (KEYS) and publishes it framed with the backlog id
+# ARGV[1] message, ARGV[2] backlog size, ARGV[3] backlog ttl, ARGV[4..n] channels
+PUBLISH_BACKLOG_SCRIPT = """
+local counts = {}
+for i = 1, #KEYS do
+    local id = redis.call('XADD', KEYS[i], 'MAXLEN', '~', ARGV[2], '*', 'm', ARGV[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+    counts[i] = redis.call('PUBLISH', ARGV[i + 3], '\\30' .. id .. '\\30' .. ARGV[1])
+end
+return counts
+"""
+
+# live messages from a backlog publish are framed as b"\x1e<id>\x1e<message>"
+BACKLOG_MARK = b"\x1e"
+
+
+def parseBacklogMessage(data):
+    # returns (backlog id or None, message)
+    if data[:1] != BACKLOG_MARK:
+        return None, data
+    msg_id, data = data[1:].split(BACKLOG_MARK, 1)
+    return msg_id.decode(), data
+
 
 def getRedisClient():
     global REDIS_CON_POOL
@@ -54,16 +87,64 @@ class RedisStore():
         if not isinstance(message, bytes):
             raise ValueError('message is {} but should be bytes'.format(type(message)))
 
-        if isinstance(pk, list):
-            count = 0
-            for spk in pk:
-                count += self.publish(message, channel, facility, pk=spk, expire=expire, prefix=prefix)
-            return count
+        if not isinstance(pk, list):
+            pk = [pk]
+        return sum(self.publishMany(message, channel, pk, facility, prefix=prefix, expire=expire).values())
+
+    def publishMany(self, message, channel, pks, facility="events", prefix=settings.WS4REDIS_PREFIX, coalesce=None, use_script=False, expire=None):
+        """
+        Publish one message to many channel pks in batched round trips.
+        Returns a dict of {channel_key: receiver count}.
+        coalesce: seconds (fractions allowed) to drop identical publishes to the same channels
+        use_script: publish each batch with a single lua call instead of a pipeline
+        When WS4REDIS_BACKLOG_SIZE is set the message is also kept in each channel backlog
+        for expire seconds (WS4REDIS_EXPIRE) so reconnecting clients can replay it.
+        """
+        if expire is None:
+            expire = self.expire
+        if not isinstance(message, RedisMessage):
+            message = RedisMessage(message)
+        if not isinstance(message, bytes):
+            raise ValueError('message is {} but should be bytes'.format(type(message)))
 
-        channel_key = self.channelToKey(channel, facility, pk, prefix)
-        logger.info("publishing to: {0}".format(channel_key))
-        count = self.connection.publish(channel_key, message)
-        return count
+        keys = list(dict.fromkeys(self.channelToKey(channel, facility, pk, prefix) for pk in pks))
+        if not keys:
+            return {}
+
+        if coalesce:
+            digest = hashlib.md5(message)
+            for key in keys:
+                digest.update(key.encode("utf-8"))
+            ckey = F"{prefix}:coalesce:{digest.hexdigest()}"
+            if not self.connection.set(ckey, 1, nx=True, px=max(1, int(coalesce * 1000))):
+                logger.info(F"coalesced publish to {len(keys)} {channel} channels")
+                return {}
+
+        counts = {}
+        batch_size = settings.WS4REDIS_PUBLISH_BATCH_SIZE
+        backlog_size = settings.WS4REDIS_BACKLOG_SIZE
+        if backlog_size and expire:
+            script = self.connection.register_script(PUBLISH_BACKLOG_SCRIPT)
+        elif use_script:
+            script = self.connection.register_script(PUBLISH_MANY_SCRIPT)
+        else:
+            script = None
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            if backlog_size and expire:
+                results = script(
+                    keys=[self.backlogKey(key) for key in batch],
+                    args=[message, backlog_size, int(expire)] + batch)
+            elif script is not None:
+                results = script(args=[message] + batch)
+            else:
+                pipe = self.connection.pipeline(transaction=False)
+                for key in batch:
+                    pipe.publish(key, message)
+                results = pipe.execute()
+            counts.update(zip(batch, results))
+        logger.info(F"publishing to {len(keys)} {channel} channels")
+        return counts
 
     def getSubMessage(self):
         # get a message pending from subscription
@@ -71,10 +152,23 @@ class RedisStore():
             return self.pubsub.parse_response()
         return None
 
-    def getPendingMessage(self, channel, facility="events", pk=None, prefix=settings.WS4REDIS_PREFIX):
-        # get a message from the connection channel
-        channel_key = self.channelToKey(channel, facility, pk, prefix)
-        return self.connection.get(channel_key)
+    def backlogKey(self, channel_key):
+        return F"{channel_key}:backlog"
+
+    def getPendingMessages(self, channel_key, last_id):
+        # returns [(id, message)] published to the channel after last_id
+        if not last_id or not settings.WS4REDIS_BACKLOG_SIZE:
+            return []
+        last_id = str(last_id)
+        try:
+            # newest first, trimming is approximate so cap at the backlog size
+            entries = self.connection.xrevrange(
+                self.backlogKey(channel_key), max="+", min=last_id, count=settings.WS4REDIS_BACKLOG_SIZE + 1)
+        except Exception:
+            logger.exception("invalid backlog id", last_id)
+            return []
+        entries = [(eid.decode(), fields[b"m"]) for eid, fields in entries]
+        return [entry for entry in reversed(entries) if entry[0] != last_id][-settings.WS4REDIS_BACKLOG_SIZE:]
 
     def channelToKey(self, channel, facility="events", pk=None, prefix=settings.WS4REDIS_PREFIX):
         if not pk:
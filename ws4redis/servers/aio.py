@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio websocket server
+
+all sockets of a process share one redis pattern subscription, incoming
+redis messages are fanned out in memory to the sockets subscribed to the
+channel key (RedisStore.channelToKey).  the websocket protocol (auth,
+subscribe, publish, etc) is the same WebsocketConnection used by the
+threaded servers, its handlers run in a thread pool because they use the ORM.
+
+    python -m ws4redis.servers.aio --host 0.0.0.0 --port 8081
+"""
+import asyncio
+import base64
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from urllib.parse import unquote
+
+import redis.asyncio
+from django import db
+from django.core.handlers.wsgi import WSGIRequest
+from io import BytesIO
+
+if __name__ == "__main__":
+    # the project imports below can load models, django must be set up first
+    import django
+    django.setup()
+
+from rest import UberDict
+from ws4redis import settings as private_settings
+from ws4redis.connection import WebsocketConnection, getRemoteIP
+from ws4redis.exceptions import WebSocketError, FrameTooLargeException, HandshakeError, UpgradeRequiredError
+from ws4redis.redis import RedisStore
+from ws4redis.servers.base import WebsocketServerBase
+from ws4redis.websocket import WebSocket, Header
+from rest.crypto import util
+
+from rest.log import getLogger
+logger = getLogger("async", filename="async.log")
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_VERSIONS = ('13', '8', '7')
+MAX_HEADERS = 100
+NO_CREDENTIALS_TIMEOUT = 40.0
+
+
+class ChannelHub(object):
+    """
+    channel key -> connections subscribed to it, shared by all sockets of the server
+    """
+    def __init__(self):
+        self.channels = dict()
+        self.lock = threading.Lock()
+
+    def subscribe(self, key, connection):
+        with self.lock:
+            self.channels.setdefault(key, set()).add(connection)
+
+    def unsubscribe(self, key, connection):
+        with self.lock:
+            conns = self.channels.get(key, None)
+            if conns is not None:
+                conns.discard(connection)
+                if not conns:
+                    del self.channels[key]
+
+    def getConnections(self, key):
+        with self.lock:
+            return list(self.channels.get(key, ()))
+
+
+class HubRedisStore(RedisStore):
+    """
+    RedisStore that subscribes through the server hub instead of its own pubsub
+    """
+    def __init__(self, hub, ws_connection, connection=None):
+        super().__init__(connection)
+        self.hub = hub
+        self.ws_connection = ws_connection
+
+    def subscribe(self, channel, facility, pk=None, prefix=private_settings.WS4REDIS_PREFIX):
+        key = self.channelToKey(channel, facility, pk, prefix)
+        if key not in self.subscriptions:
+            logger.info(F"subscribing to: {key}")
+            self.subscriptions.append(key)
+            self.hub.subscribe(key, self.ws_connection)
+            # same reply redis gives a pubsub subscribe
+            self.ws_connection.on_redis_msg([b'subscribe', key.encode(), len(self.subscriptions)])
+        return key
+
+    def unsubscribe(self, channel, facility, pk=None, prefix=private_settings.WS4REDIS_PREFIX):
+        key = self.channelToKey(channel, facility, pk, prefix)
+        if key in self.subscriptions:
+            logger.info(F"unsubscribing to: {key}")
+            self.subscriptions.remove(key)
+            self.hub.unsubscribe(key, self.ws_connection)
+            self.ws_connection.on_redis_msg([b'unsubscribe', key.encode(), len(self.subscriptions)])
+
+    def get_file_descriptor(self):
+        return None
+
+    def release(self):
+        self.unpublishModelOnline()
+        for key in self.subscriptions:
+            self.hub.unsubscribe(key, self.ws_connection)
+        self.subscriptions = []
+
+
+class AsyncWebSocket(object):
+    """
+    websocket over asyncio streams, send and close can be called from any thread
+    """
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.outbox = asyncio.Queue()
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def get_file_descriptor(self):
+        return None
+
+    def flush(self):
+        pass
+
+    def _queue(self, frame):
+        if threading.get_ident() == self.loop_thread:
+            self.outbox.put_nowait(frame)
+        else:
+            self.loop.call_soon_threadsafe(self.outbox.put_nowait, frame)
+
+    def send_frame(self, message, opcode):
+        if self._closed:
+            raise WebSocketError("Connection is already closed")
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        elif not isinstance(message, bytes):
+            message = bytes(message or b'')
+        self._queue(Header.encode_header(True, opcode, b'', len(message), 0) + message)
+
+    def send(self, message, binary=False):
+        if binary is None:
+            binary = not isinstance(message, str)
+        self.send_frame(message, WebSocket.OPCODE_BINARY if binary else WebSocket.OPCODE_TEXT)
+
+    def close(self, code=1000, message=''):
+        if self._closed:
+            return
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        self.send_frame(struct.pack('!H', code) + (message or b'')[:123], WebSocket.OPCODE_CLOSE)
+        self._closed = True
+        self._queue(None)
+
+    async def writeLoop(self):
+        try:
+            while True:
+                frame = await self.outbox.get()
+                if frame is None:
+                    break
+                self.writer.write(frame)
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            self._closed = True
+        finally:
+            self.writer.close()
+
+    async def readFrame(self):
+        read = self.reader.readexactly
+        first_byte, second_byte = await read(2)
+        header = Header(
+            fin=first_byte & Header.FIN_MASK == Header.FIN_MASK,
+            opcode=first_byte & Header.OPCODE_MASK,
+            flags=first_byte & Header.HEADER_FLAG_MASK,
+            length=second_byte & Header.LENGTH_MASK)
+        if header.flags:
+            raise WebSocketError("unsupported frame flags")
+        if header.opcode > 0x07:
+            if not header.fin:
+                raise WebSocketError("Received fragmented control frame")
+            if header.length > 125:
+                raise FrameTooLargeException("Control frame cannot be larger than 125 bytes")
+        if header.length == 126:
+            header.length = struct.unpack('!H', await read(2))[0]
+        elif header.length == 127:
+            header.length = struct.unpack('!Q', await read(8))[0]
+        if header.length > private_settings.WS4REDIS_MAX_MESSAGE_SIZE:
+            raise FrameTooLargeException("frame of {} bytes".format(header.length))
+        if second_byte & Header.MASK_MASK:
+            header.mask = await read(4)
+        payload = await read(header.length) if header.length else b''
+        if header.mask:
+            payload = header.unmask_payload(payload)
+        return header, payload
+
+    async def receive(self):
+        """
+        returns the next text or binary message, None once the socket is closed
+        """
+        opcode = None
+        message = b''
+        while True:
+            header, payload = await self.readFrame()
+            if header.opcode in (WebSocket.OPCODE_TEXT, WebSocket.OPCODE_BINARY):
+                if opcode:
+                    raise WebSocketError("The opcode in non-fin frame is expected to be zero")
+                opcode = header.opcode
+            elif header.opcode == WebSocket.OPCODE_CONTINUATION:
+                if not opcode:
+                    raise WebSocketError("Unexpected frame with opcode=0")
+            elif header.opcode == WebSocket.OPCODE_PING:
+                self.send_frame(payload, WebSocket.OPCODE_PONG)
+                continue
+            elif header.opcode == WebSocket.OPCODE_PONG:
+                continue
+            elif header.opcode == WebSocket.OPCODE_CLOSE:
+                self.close()
+                return None
+            else:
+                raise WebSocketError("Unexpected opcode={0!r}".format(header.opcode))
+            message += payload
+            if len(message) > private_settings.WS4REDIS_MAX_MESSAGE_SIZE:
+                raise FrameTooLargeException("message of {} bytes".format(len(message)))
+            if header.fin:
+                break
+        if opcode == WebSocket.OPCODE_TEXT:
+            try:
+                return message.decode("utf-8")
+            except UnicodeDecodeError:
+                self.close(1007)
+                return None
+        return bytearray(message)
+
+
+class AsyncWebsocketConnection(WebsocketConnection):
+    def __init__(self, server, environ, websocket):
+        self.server = server
+        self.request = WSGIRequest(environ)
+        self.ip = getRemoteIP(self.request)
+        self.ua = self.request.META.get('HTTP_USER_AGENT', '')
+        self.facility = self.request.path_info.replace(private_settings.WEBSOCKET_URL, '', 1)
+        self.credentials = UberDict()
+        self.listening_fds = None
+        self.redis = HubRedisStore(server.hub, self, server._redis_connection)
+        self.websocket = websocket
+        self.last_beat = time.time()
+        self.last_cred_check = time.time()
+        self.last_msg = None
+        self._heart_beat = util.toString(private_settings.WS4REDIS_HEARTBEAT)
+
+    def refreshFDs(self):
+        # no select loop, messages are pushed by the server
+        pass
+
+    def on_ws_msg(self, raw_data):
+        try:
+            super().on_ws_msg(raw_data)
+        except Exception:
+            logger.exception()
+        finally:
+            db.close_old_connections()
+
+    def release(self):
+        self.redis.release()
+        if self.websocket:
+            self.websocket.close(code=1001, message='Websocket Closed')
+
+
+class AsyncWebsocketServer(WebsocketServerBase):
+    def __init__(self, redis_connection=None, workers=None):
+        super().__init__(redis_connection)
+        self.hub = ChannelHub()
+        self.connections = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers or private_settings.WS4REDIS_ASYNC_WORKERS)
+        self.loop = None
+
+    async def runSync(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def readHandshake(self, reader, writer):
+        """
+        reads the http upgrade request and returns the wsgi environ for it
+        """
+        line = (await reader.readline()).decode("latin-1").strip()
+        parts = line.split(" ")
+        if len(parts) != 3:
+            raise HandshakeError("invalid request line")
+        method, target, protocol = parts
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        sock = writer.get_extra_info("sockname") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SERVER_PROTOCOL": protocol,
+            "PATH_INFO": unquote(path),
+            "QUERY_STRING": query,
+            "REMOTE_ADDR": peer[0],
+            "SERVER_NAME": sock[0],
+            "SERVER_PORT": str(sock[1]),
+            "SCRIPT_NAME": "",
+            "wsgi.input": BytesIO(),
+            "wsgi.url_scheme": "http",
+        }
+        for i in range(MAX_HEADERS):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            name = name.strip().upper().replace("-", "_")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            environ[name] = value.strip()
+        else:
+            raise HandshakeError("too many headers")
+        return environ
+
+    def acceptHeaders(self, environ):
+        websocket_version = environ.get('HTTP_SEC_WEBSOCKET_VERSION', '')
+        if not websocket_version:
+            raise UpgradeRequiredError
+        elif websocket_version not in WS_VERSIONS:
+            raise HandshakeError('Unsupported WebSocket Version: {0}'.format(websocket_version))
+        key = environ.get('HTTP_SEC_WEBSOCKET_KEY', '').strip()
+        try:
+            key_len = len(base64.b64decode(key))
+        except Exception:
+            raise HandshakeError('Invalid key: {0}'.format(key))
+        if key_len != 16:
+            raise HandshakeError('Invalid key: {0}'.format(key))
+        sec_ws_accept = base64.b64encode(sha1(key.encode("ascii") + WS_GUID).digest()).decode('ascii')
+        headers = [
+            ('Upgrade', 'websocket'),
+            ('Connection', 'Upgrade'),
+            ('Sec-WebSocket-Accept', sec_ws_accept),
+            ('Sec-WebSocket-Version', str(websocket_version)),
+        ]
+        if environ.get('HTTP_SEC_WEBSOCKET_PROTOCOL') is not None:
+            headers.append(('Sec-WebSocket-Protocol', environ.get('HTTP_SEC_WEBSOCKET_PROTOCOL')))
+        return headers
+
+    async def handleClient(self, reader, writer):
+        try:
+            environ = await self.readHandshake(reader, writer)
+            if not environ["PATH_INFO"].startswith(private_settings.WEBSOCKET_URL):
+                raise HandshakeError("not a websocket url")
+            self.assure_protocol_requirements(environ)
+            headers = self.acceptHeaders(environ)
+        except (HandshakeError, UnicodeError, ConnectionError, asyncio.IncompleteReadError) as err:
+            status = "426 Upgrade Required" if isinstance(err, UpgradeRequiredError) else "400 Bad Request"
+            logger.warning("websocket handshake failed", str(err))
+            try:
+                writer.write("HTTP/1.1 {}\r\nConnection: close\r\nContent-Length: 0\r\n\r\n".format(status).encode("latin-1"))
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+        response = "HTTP/1.1 101 Switching Protocols\r\n" + "".join("{}: {}\r\n".format(k, v) for k, v in headers) + "\r\n"
+        writer.write(response.encode("latin-1"))
+
+        websocket = AsyncWebSocket(reader, writer, self.loop)
+        writer_task = self.loop.create_task(websocket.writeLoop())
+        connection = AsyncWebsocketConnection(self, environ, websocket)
+        self.connections.add(connection)
+        try:
+            await self.runSync(connection.on_url_auth)
+            while not websocket.closed:
+                message = await websocket.receive()
+                if message is None:
+                    break
+                if message:
+                    await self.runSync(connection.on_ws_msg, message)
+        except (WebSocketError, ConnectionError, asyncio.IncompleteReadError) as err:
+            logger.info("websocket closed", str(err))
+        except Exception:
+            logger.exception()
+        finally:
+            logger.info("closing websocket")
+            self.connections.discard(connection)
+            try:
+                await self.runSync(connection.release)
+            except (RuntimeError, asyncio.CancelledError):
+                # shutting down, the executor is gone
+                connection.release()
+            try:
+                # let the close frame go out
+                await asyncio.wait_for(writer_task, 5.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                writer_task.cancel()
+
+    def dispatch(self, channel, data):
+        # fan a redis message out to every socket subscribed to its channel
+        for connection in self.hub.getConnections(channel.decode()):
+            try:
+                connection.on_redis_msg([b'message', channel, data])
+            except Exception as err:
+                logger.info("closing websocket", str(err))
+                connection.websocket.close()
+
+    async def listenRedis(self):
+        pattern = F"{private_settings.WS4REDIS_PREFIX}:*"
+        while True:
+            client = redis.asyncio.Redis(**private_settings.WS4REDIS_CONNECTION)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(pattern)
+                async for msg in pubsub.listen():
+                    if msg["type"] == "pmessage":
+                        self.dispatch(msg["channel"], msg["data"])
+            except (redis.exceptions.ConnectionError, OSError):
+                logger.exception("redis subscription lost, reconnecting")
+                await asyncio.sleep(1.0)
+            finally:
+                await (getattr(pubsub, "aclose", None) or pubsub.reset)()
+                await (getattr(client, "aclose", None) or client.close)()
+
+    async def checkConnections(self):
+        # heartbeats and warnings for sockets that never authenticate
+        while True:
+            await asyncio.sleep(4.0)
+            now = time.time()
+            for connection in list(self.connections):
+                try:
+                    connection.checkHeartbeat()
+                    if not connection.credentials and now - connection.last_cred_check > NO_CREDENTIALS_TIMEOUT:
+                        connection.last_cred_check = now
+                        logger.error(f"{connection.ip} has sent no credentials", connection.ua)
+                        connection.sendToWS("member", dict(error="no credentials received"))
+                except WebSocketError:
+                    pass
+
+    async def serve(self, host="0.0.0.0", port=8081):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handleClient, host, port)
+        logger.info("asyncio websocket server listening", host, port)
+        tasks = [self.loop.create_task(self.listenRedis()), self.loop.create_task(self.checkConnections())]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def run(host="0.0.0.0", port=8081, workers=None):
+    asyncio.run(AsyncWebsocketServer(workers=workers).serve(host, int(port)))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="asyncio ws4redis websocket server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--workers", type=int, default=None, help="threads for auth/subscribe/publish handlers")
+    args = parser.parse_args()
+    run(args.host, args.port, args.workers)
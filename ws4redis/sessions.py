@@ -0,0 +1,70 @@
+"""
+Django session engine that keeps sessions in redis using the ws4redis connection pool.
+
+    SESSION_ENGINE = "ws4redis.sessions"
+"""
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
+
+from ws4redis import settings
+from ws4redis.redis import getRedisClient
+
+
+class SessionStore(SessionBase):
+    key_prefix = F"{settings.WS4REDIS_PREFIX}:session:"
+
+    def __init__(self, session_key=None):
+        self.connection = getRedisClient()
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.key_prefix + self._get_or_create_session_key()
+
+    def load(self):
+        session_data = None
+        if self.session_key is not None:
+            session_data = self.connection.get(self.key_prefix + self.session_key)
+        if session_data is not None:
+            # decode returns {} if the data was tampered with
+            return self.decode(session_data.decode())
+        self._session_key = None
+        return {}
+
+    def create(self):
+        for i in range(10000):
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+        raise RuntimeError("Unable to create a new session key, is redis available?")
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self.encode(self._get_session(no_load=must_create))
+        # nx creates, xx updates an existing session only
+        result = self.connection.set(
+            self.cache_key, data, ex=self.get_expiry_age(),
+            nx=must_create, xx=not must_create)
+        if not result:
+            if must_create:
+                raise CreateError
+            raise UpdateError
+
+    def exists(self, session_key):
+        return bool(session_key) and bool(self.connection.exists(self.key_prefix + session_key))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self.connection.delete(self.key_prefix + session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        # redis expires the keys itself
+        pass
@@ -38,3 +38,26 @@ WS4REDIS_CHANNELS = getattr(settings, "WS4REDIS_CHANNELS", {})
 WS4REDIS_AUTHENTICATORS = getattr(settings, "WS4REDIS_AUTHENTICATORS", {})
 
 URL_AUTHENTICATOR = getattr(settings, "URL_AUTHENTICATOR", None)
+
+"""
+Threads used by the asyncio server (ws4redis.servers.aio) to run auth, subscribe and publish handlers.
+"""
+WS4REDIS_ASYNC_WORKERS = getattr(settings, "WS4REDIS_ASYNC_WORKERS", 32)
+
+"""
+Largest websocket message in bytes the asyncio server accepts from a client.
+"""
+WS4REDIS_MAX_MESSAGE_SIZE = getattr(settings, "WS4REDIS_MAX_MESSAGE_SIZE", 1048576)
+
+"""
+Number of channels sent per pipeline (or lua call) when publishing to many channels at once.
+"""
+WS4REDIS_PUBLISH_BATCH_SIZE = getattr(settings, "WS4REDIS_PUBLISH_BATCH_SIZE", 1000)
+
+"""
+Messages kept per channel so reconnecting clients can replay what they missed, 0 disables it.
+Backlogs expire after WS4REDIS_EXPIRE seconds without a publish.
+Enabling it frames published messages with their backlog id, every subscriber must
+unframe them with parseBacklogMessage, so upgrade all nodes before turning it on.
+"""
+WS4REDIS_BACKLOG_SIZE = getattr(settings, "WS4REDIS_BACKLOG_SIZE", 0)
@@ -0,0 +1,40 @@
+from django.test import TestCase
+from unittest import skipUnless
+import os
+import subprocess
+import sys
+
+from ws4redis.redis import RedisStore
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class ServerImportTest(TestCase):
+    def runPython(self, *args):
+        # a fresh interpreter, nothing imported and django not set up yet
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        return subprocess.run([sys.executable] + list(args), env=env, capture_output=True, text=True, timeout=60)
+
+    def test_import_aio(self):
+        result = self.runPython("-c", "import ws4redis.servers.aio")
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_run_aio_module(self):
+        result = self.runPython("-m", "ws4redis.servers.aio", "--help")
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("--port", result.stdout)
+
+
+@skipUnless(fakeredis, "needs fakeredis")
+class PublishManyTest(TestCase):
+    def test_subsecond_coalesce(self):
+        store = RedisStore(fakeredis.FakeStrictRedis())
+        # a 0.25 second window used to become ex=0 and fail the SET
+        self.assertEqual(len(store.publishMany(b"hi", "group", [1, 2], coalesce=0.25)), 2)
+        keys = store.connection.keys("*:coalesce:*")
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(0 < store.connection.pttl(keys[0]) <= 250)
+        self.assertEqual(store.publishMany(b"hi", "group", [1, 2], coalesce=0.25), {})
@@ -27,6 +27,7 @@
 ##
 ###############################################################################
 
+import codecs
 
 ## use Cython implementation of UTF8 validator if available
 ##
@@ -97,6 +98,7 @@ except:
             self.state = Utf8Validator.UTF8_ACCEPT
             self.codepoint = 0
             self.i = 0
+            self.decoder = codecs.getincrementaldecoder("utf-8")()
 
         def validate(self, ba):
             """
@@ -112,17 +114,20 @@ except:
             total amount of consumed bytes.
             """
 
+            ## the C utf-8 codec does the same validation incrementally, partial
+            ## sequences at the end of a chunk are kept until the next call
             l = len(ba)
-
-            for i in range(l):
-                ## optimized version of decode(), since we are not interested in actual code points
-
-                self.state = Utf8Validator.UTF8VALIDATOR_DFA[256 + (self.state << 4) + Utf8Validator.UTF8VALIDATOR_DFA[ord(ba[i])]]
-
-                if self.state == Utf8Validator.UTF8_REJECT:
-                    self.i += i
-                    return False, False, i, self.i
+            pending = len(self.decoder.getstate()[0])
+            try:
+                self.decoder.decode(ba)
+            except UnicodeDecodeError as err:
+                i = max(err.start - pending, 0)
+                self.i += i
+                self.state = Utf8Validator.UTF8_REJECT
+                return False, False, i, self.i
 
             self.i += l
+            ends_on_codepoint = not self.decoder.getstate()[0]
+            self.state = Utf8Validator.UTF8_ACCEPT if ends_on_codepoint else 2
 
-            return True, self.state == Utf8Validator.UTF8_ACCEPT, l, self.i
+            return True, ends_on_codepoint, l, self.i
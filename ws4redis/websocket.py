@@ -136,7 +136,7 @@ class WebSocket(object):
             payload = self.stream.read(header.length)
         except socket_error:
             payload = ''
-        except Exception:
+        except Exception as e:
             logger.debug("{}: {}".format(type(e), six.text_type(e)))
             payload = ''
         if len(payload) != header.length:
@@ -162,7 +162,8 @@ class WebSocket(object):
         if an exception is called. Use `receive` instead.
         """
         opcode = None
-        message = None
+        # collect raw frame payloads, joined and decoded once at the end
+        message = []
         while True:
             header, payload = self.read_frame()
             f_opcode = header.opcode
@@ -188,21 +189,18 @@ class WebSocket(object):
                 return
             else:
                 raise WebSocketError("Unexpected opcode={0!r}".format(f_opcode))
-            if opcode == self.OPCODE_TEXT:
+            if opcode == self.OPCODE_TEXT and payload:
+                # fail fast on invalid utf-8, sequences may span frames
                 self.validate_utf8(payload)
-                if six.PY3:
-                    payload = payload.decode()
-            if message is None:
-                message = six.text_type() if opcode == self.OPCODE_TEXT else six.binary_type()
-            message += payload
+            if payload:
+                message.append(payload)
             if header.fin:
                 break
+        message = six.binary_type().join(message)
         if opcode == self.OPCODE_TEXT:
-            if six.PY2:
-                self.validate_utf8(message)
-            else:
-                self.validate_utf8(message.encode())
-            return message
+            if not self.utf8validate_last[1]:
+                raise UnicodeError("Text message ends in a truncated UTF-8 sequence")
+            return message.decode('utf-8')
         else:
             return bytearray(message)
 
@@ -320,13 +318,19 @@ class Header(object):
         self.length = length
 
     def mask_payload(self, payload):
-        payload = bytearray(payload)
-        mask = bytearray(self.mask)
-        for i in xrange(self.length):
-            payload[i] ^= mask[i % 4]
-        if six.PY3:
-            return bytes(payload)
-        return str(payload)
+        length = len(payload)
+        if not length:
+            return six.binary_type()
+        if six.PY2:
+            payload = bytearray(payload)
+            mask = bytearray(self.mask)
+            for i in xrange(length):
+                payload[i] ^= mask[i % 4]
+            return str(payload)
+        # xor the whole buffer at once as big integers instead of per byte
+        key = (bytes(self.mask) * (length // 4 + 1))[:length]
+        value = int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')
+        return value.to_bytes(length, 'big')
 
     # it's the same operation
     unmask_payload = mask_payload